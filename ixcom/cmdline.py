@@ -1,11 +1,10 @@
 import ixcom
+import ixcom.grep
 import time
 import sys
 import struct
 import argparse
 import socket
-import io
-import os
 
 
 class TextFileParser(ixcom.parser.MessageParser):
@@ -200,17 +199,12 @@ def split_config(argv = None):
                        help='Filename of the output file', default = sys.stdout.buffer)  
     parser.add_argument('parameter_ids', metavar = 'ID', type=int, nargs = '+', help = 'Parameter IDs to pass through')
     args = parser.parse_args()
-    xcomparser = ixcom.parser.MessageSearcher()
+    xcomparser = ixcom.parser.MessageSearcher(message_ids = [ixcom.data.MessageID.PARAMETER], parameter_ids = args.parameter_ids)
     
        
     try:
         def callback(msg_bytes):
-            message = ixcom.data.ProtocolMessage()
-            message.payload = ixcom.data.DefaultParameterPayload()
-            message.payload.from_bytes(msg_bytes[16:20])
-            parameterID = message.payload.data['parameterID']
-            if parameterID in args.parameter_ids:
-                args.output.write(msg_bytes)
+            args.output.write(msg_bytes)
             
         xcomparser.add_callback(callback)
         xcomparser.process_bytes(args.inputfile.read())
@@ -228,11 +222,9 @@ def remove_partial_msgs(argv = None):
     args = parser.parse_args()
     xcomparser = ixcom.parser.MessageSearcher(disable_crc = False)
 
-    iob = io.BytesIO(b'')
     def r_callback(in_bytes):
-        iob.write(in_bytes)
+        args.output.write(in_bytes)
 
     xcomparser.add_callback(r_callback)
-    xcomparser.process_bytes(args.inputfile.read())
-    iob.seek(0, os.SEEK_SET)
-    args.output.write(iob.read())
\ No newline at end of file
+    with ixcom.grep.map_file(args.inputfile) as buffer:
+        xcomparser.process_bytes(buffer)
@@ -1,3 +1,5 @@
+import struct
+
 from .protocol import DefaultCommandPayload, command, Message, PayloadItem
 
 """
@@ -39,3 +41,30 @@ class CMD_EXTAID_Payload(DefaultCommandPayload):
         PayloadItem(name = 'timeMode', dimension = 1, datatype = 'H'),
         PayloadItem(name = 'cmdParamID', dimension = 1, datatype = 'H'),
     ])
+
+    def get_varsize_item_list(self, cmdParamID):
+        _item_list = list(type(self).command_payload.item_list)
+        if cmdParamID == 3:
+            for name in ['lon', 'lat', 'alt', 'lonStdDev', 'latStdDev', 'altStdDev', 'laX', 'laY', 'laZ', 'laXStdDev', 'laYStdDev', 'laZStdDev']:
+                _item_list += [PayloadItem(name = name, dimension = 1, datatype = 'd')]
+            _item_list += [PayloadItem(name = 'enableMSL_Alt', dimension = 1, datatype = 'I')]
+        elif cmdParamID == 4:
+            for name in ['vN', 'vE', 'vD', 'vNStdDev', 'vEStdDev', 'vDStdDev']:
+                _item_list += [PayloadItem(name = name, dimension = 1, datatype = 'd')]
+        elif cmdParamID == 5:
+            _item_list += [
+                PayloadItem(name = 'heading', dimension = 1, datatype = 'd'),
+                PayloadItem(name = 'headingStdDev', dimension = 1, datatype = 'd'),
+            ]
+        elif cmdParamID == 6:
+            _item_list += [
+                PayloadItem(name = 'height', dimension = 1, datatype = 'd'),
+                PayloadItem(name = 'heightStdDev', dimension = 1, datatype = 'd'),
+            ]
+        return _item_list
+
+    def get_varsize_arg_from_bytes(self, inBytes):
+        if len(inBytes) < 16:
+            return None
+        cmdParamID = struct.unpack('H', inBytes[14:16])[0]
+        return cmdParamID
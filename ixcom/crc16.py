@@ -1,3 +1,7 @@
+import struct
+
+import numpy
+
 try:
     import fastcrc.crc16
     fastcrc_installed = True
@@ -46,9 +50,164 @@ def __crc16(data, crc, table):
         crc = ((crc << 8) & 0xff00) ^ table[((crc >> 8) & 0xff)^byte]
     return crc & 0xffff
 
+
+# Slicing tables: row k holds the CRC of a single byte followed by k zero bytes.
+# As the CRC is linear, the CRC of a block is the XOR of the rows selected by
+# each byte and its distance to the end of the block.
+POSITION_TABLE_ROWS = 4160
+NUMPY_MIN_LENGTH = 512
+__position_table = None
+__word_tables = None
+
+
+def __get_position_table():
+    global __position_table
+    if __position_table is None:
+        crc_table = numpy.array(__crc16_table, dtype=numpy.uint16)
+        table = numpy.empty((POSITION_TABLE_ROWS, 256), dtype=numpy.uint16)
+        table[0] = crc_table
+        for k in range(1, POSITION_TABLE_ROWS):
+            table[k] = (table[k-1] << 8) ^ crc_table[table[k-1] >> 8]
+        __position_table = table
+    return __position_table
+
+
+def __get_word_tables():
+    global __word_tables
+    if __word_tables is None:
+        table = __get_position_table()
+        word = numpy.arange(0x10000)
+        # CRC register after shifting a 16 bit value through two and four zero bytes
+        two = table[1][word >> 8] ^ table[0][word & 0xff]
+        four = table[3][word >> 8] ^ table[2][word & 0xff]
+        __word_tables = (two.tolist(), four.tolist())
+    return __word_tables
+
+
+def __crc16_slicing_by_4(data, crc):
+    two, four = __get_word_tables()
+    data = memoryview(data).cast('B')
+    num_words = len(data) // 4
+    for high, low in struct.iter_unpack('>HH', data[:4*num_words]):
+        crc = four[crc ^ high] ^ two[low]
+    return __crc16(data[4*num_words:], crc, __crc16_table)
+
+
+def __crc16_numpy(data, crc):
+    table = __get_position_table().reshape(-1)
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    for block_start in range(0, len(data), POSITION_TABLE_ROWS):
+        block = data[block_start:block_start + POSITION_TABLE_ROWS]
+        block_len = len(block)
+        if block_len < 2:
+            return __crc16(block.tolist(), crc, __crc16_table)
+        rows = numpy.arange(block_len - 1, -1, -1, dtype=numpy.intp)
+        # the previous register is shifted out like two leading data bytes
+        crc = int(table[((block_len - 1) << 8) | (crc >> 8)] ^ table[((block_len - 2) << 8) | (crc & 0xff)]) \
+            ^ int(numpy.bitwise_xor.reduce(table[(rows << 8) | block]))
+    return crc
+
+
+def __crc16_pure(data, crc):
+    if len(data) >= NUMPY_MIN_LENGTH:
+        return __crc16_numpy(data, crc)
+    else:
+        return __crc16_slicing_by_4(data, crc)
+
+
 if fastcrc_installed:
     def crc16xmodem(data, crc=0):
-        return fastcrc.crc16.xmodem(data)
+        return fastcrc.crc16.xmodem(bytes(data), initial=crc)
 else:
     def crc16xmodem(data, crc=0):
-        return __crc16(data, crc, __crc16_table)
+        return __crc16_pure(data, crc)
+
+
+class Crc16Xmodem:
+    '''Incremental CRC-16/XMODEM
+
+    Feeding data piecewise with update() gives the same checksum as crc16xmodem() over
+    the concatenated data, independent of the installed backend.
+    '''
+    def __init__(self, data=b'', crc=0):
+        self.crc = crc
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        self.crc = crc16xmodem(data, self.crc)
+
+    def digest(self):
+        '''Returns the checksum of all data passed so far as integer'''
+        return self.crc
+
+    def reset(self, crc=0):
+        self.crc = crc
+
+
+VERIFY_BATCH_BYTES = 1 << 20
+
+
+def __stored_crcs(data, offsets, lengths):
+    ends = offsets + lengths
+    return data[ends - 2].astype(numpy.uint16) | (data[ends - 1].astype(numpy.uint16) << 8)
+
+
+def __crc16_frames(data, offsets, crc_lengths):
+    table = __get_position_table().reshape(-1)
+    starts = numpy.zeros(len(crc_lengths), dtype=numpy.intp)
+    numpy.cumsum(crc_lengths[:-1], out=starts[1:])
+    byte_idx = numpy.arange(starts[-1] + crc_lengths[-1], dtype=numpy.intp)
+    byte_idx += numpy.repeat(offsets - starts, crc_lengths)
+    rows = numpy.repeat(offsets + crc_lengths - 1, crc_lengths) - byte_idx
+    return numpy.bitwise_xor.reduceat(table[(rows << 8) | data[byte_idx]], starts)
+
+
+def __verify_frames_fastcrc(data, offsets, lengths):
+    valid = numpy.zeros(len(offsets), dtype=bool)
+    frame_idx = numpy.flatnonzero(lengths > 2)
+    starts = offsets[frame_idx]
+    ends = starts + lengths[frame_idx] - 2
+    view = memoryview(data)
+    xmodem = fastcrc.crc16.xmodem
+    crcs = numpy.fromiter((xmodem(view[start:end]) for start, end in zip(starts.tolist(), ends.tolist())),
+                          dtype=numpy.uint16, count=len(frame_idx))
+    valid[frame_idx] = crcs == __stored_crcs(data, starts, lengths[frame_idx])
+    return valid
+
+
+def verify_frames(buffer, offsets, lengths):
+    '''Checks the CRC of many frames in one vectorized pass
+
+    With fastcrc installed, the frames are checked one by one by fastcrc instead.
+
+    Args:
+        buffer: bytes-like object containing the frames
+        offsets: start index of each frame in buffer
+        lengths: length of each frame including the trailing CRC
+
+    Returns:
+        Boolean numpy array which is True for every frame with a matching CRC
+    '''
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    offsets = numpy.asarray(offsets, dtype=numpy.intp)
+    lengths = numpy.asarray(lengths, dtype=numpy.intp)
+    if fastcrc_installed:
+        return __verify_frames_fastcrc(data, offsets, lengths)
+    valid = numpy.zeros(len(offsets), dtype=bool)
+    crc_lengths = lengths - 2
+    in_table = (crc_lengths > 0) & (crc_lengths <= POSITION_TABLE_ROWS)
+    long_idx = numpy.flatnonzero(~in_table & (crc_lengths > 0))
+    stored = __stored_crcs(data, offsets[long_idx], lengths[long_idx]).tolist()
+    for idx, stored_crc in zip(long_idx.tolist(), stored):
+        valid[idx] = crc16xmodem(data[offsets[idx]:offsets[idx] + crc_lengths[idx]]) == stored_crc
+    frame_idx = numpy.flatnonzero(in_table)
+    batch_ends = numpy.cumsum(crc_lengths[frame_idx])
+    batch_start = 0
+    while batch_start < len(frame_idx):
+        done = batch_ends[batch_start - 1] if batch_start else 0
+        batch_end = max(int(numpy.searchsorted(batch_ends, done + VERIFY_BATCH_BYTES, side='right')), batch_start + 1)
+        batch = frame_idx[batch_start:batch_end]
+        valid[batch] = __crc16_frames(data, offsets[batch], crc_lengths[batch]) == __stored_crcs(data, offsets[batch], lengths[batch])
+        batch_start = batch_end
+    return valid
@@ -1,14 +1,40 @@
-import struct
 import os
 import io
+import mmap
+import contextlib
+import functools
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from numpy.lib.recfunctions import append_fields
 
-from .parser import MessageParser, MessageSearcher
-from . import data
+from .parser import MessageParser, MessageSearcher, TOTAL_MAX_MESSAGE_LENGTH
+from . import crc16, data, protocol
+from .protocol import VarsizeRecords
 from .exceptions import EndOfConfig
 
+FRAMING_CHUNK_SIZE = 64 << 20
+FRAMING_STREAM_CHUNK_SIZE = 1 << 22
+CHAIN_BATCH_MIN_FRAMES = 16
+CHAIN_BATCH_MAX_FRAMES = 4096
+ANCHOR_SEARCH_BLOCK_SIZE = 1 << 16
+GATHER_BATCH_BYTES = 1 << 22
+GATHER_BATCH_FRAMES = 1 << 16
+GROWABLE_MIN_CHUNK_BYTES = 1 << 16
+GROWABLE_CHUNK_DIVISOR = 4
+FRAME_INDEX_SUFFIX = '.idx.npy'
+FINGERPRINT_SAMPLE_BYTES = 1 << 12
+INDEX_SEARCH_STEP = 1024
+HEADER_DTYPE = np.dtype([
+    ('sync', 'u1'), ('msg_id', 'u1'), ('frame_counter', 'u1'), ('reserved_header', 'u1'),
+    ('msg_length', '<u2'), ('week', '<u2'), ('time_of_week_sec', '<u4'), ('time_of_week_usec', '<u4'),
+])
+FRAME_INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'), ('msg_id', 'u1'), ('sub_id', '<u2'), ('length', '<u2'),
+    ('week', '<u2'), ('time_of_week', '<f8'), ('crc_ok', '?'),
+])
+RECORDING_FINGERPRINT_DTYPE = np.dtype([('size', '<u8'), ('mtime_ns', '<i8'), ('sample_crc', '<u2')])
+
 def get_item_len(item):
     if isinstance(item, (list, tuple)):
         item_len = len(item)
@@ -16,22 +42,558 @@ def get_item_len(item):
         item_len = 1
     return item_len
 
-def grep_file(filename='iXCOMstream.bin'):
-    message_files_dict = dict()
-    message_searcher = MessageSearcher(disable_crc = True)
+def get_frame_length(buffer, pos):
+    '''Returns the length of the frame at pos if its header is plausible and it fits into buffer, else 0'''
+    if pos + 6 > len(buffer) or buffer[pos] != data.SYNC_BYTE:
+        return 0
+    msg_length = buffer[pos + 4] + 256*buffer[pos + 5]
+    if not 6 < msg_length < TOTAL_MAX_MESSAGE_LENGTH + 6 or pos + msg_length > len(buffer):
+        return 0
+    return msg_length
 
-    def message_callback(in_bytes):
-        message_id = int(in_bytes[1])
-        if message_id not in message_files_dict:
-            message_files_dict[message_id] = open('{}.bin'.format(hex(message_id)), 'wb')
-        message_files_dict[message_id].write(in_bytes)
+def find_first_frame(buffer, start, end, disable_crc = False):
+    '''Searches the first frame starting in buffer[start:end] with valid sync byte, length and CRC
 
-    message_searcher.add_callback(message_callback)
+    The CRC is not checked if disable_crc is set.
+
+    Returns:
+        Offset of the frame, None if there is none
+    '''
+    in_array = np.frombuffer(buffer, dtype=np.uint8)
+    for block_start in range(start, end, ANCHOR_SEARCH_BLOCK_SIZE):
+        block_end = min(block_start + ANCHOR_SEARCH_BLOCK_SIZE, end)
+        for pos in (np.flatnonzero(in_array[block_start:block_end] == data.SYNC_BYTE) + block_start).tolist():
+            msg_length = get_frame_length(buffer, pos)
+            if msg_length and (disable_crc or crc16.crc16xmodem(buffer[pos:pos + msg_length - 2]) == buffer[pos + msg_length - 2] + 256*buffer[pos + msg_length - 1]):
+                return pos
+    return None
+
+def _chain_frames(buffer, pos, end, max_frames):
+    '''Follows up to max_frames frames by their length field from pos
+
+    Returns:
+        Tuple (offsets, lengths, pos, broken) where pos is the position behind the last frame and
+        broken tells whether the chain stopped at an implausible header at pos before end
+    '''
+    offsets = []
+    lengths = []
+    while pos < end and len(offsets) < max_frames:
+        msg_length = get_frame_length(buffer, pos)
+        if not msg_length:
+            return offsets, lengths, pos, True
+        offsets.append(pos)
+        lengths.append(msg_length)
+        pos += msg_length
+    return offsets, lengths, pos, False
+
+def frame_range(buffer, start, end, anchored = False, disable_crc = False):
+    '''Frames buffer from start up to the first frame which starts at or after end
+
+    Unless anchored is set, framing begins at the first frame found by find_first_frame. Frames follow
+    each other by their length field and their CRCs are verified in batches unless disable_crc is set,
+    in which case all frames count as valid. After an implausible header or a frame with wrong CRC, the
+    next frame is searched with find_first_frame from the byte behind the false sync byte, like
+    MessageSearcher.process_bytes does.
+
+    Returns:
+        Tuple (offsets, lengths, crc_ok, next_pos) of int64 and bool numpy arrays in file order and the start
+        of the frame following the range, or None if the range ended while searching for a frame
+    '''
+    offsets = []
+    lengths = []
+    crc_ok = []
+    pos = start if anchored else find_first_frame(buffer, start, end, disable_crc)
+    batch_frames = CHAIN_BATCH_MIN_FRAMES
+    while pos is not None and pos < end:
+        chain_offsets, chain_lengths, next_pos, broken = _chain_frames(buffer, pos, end, batch_frames)
+        if disable_crc:
+            chain_crc_ok = np.ones(len(chain_offsets), dtype=bool)
+        else:
+            chain_crc_ok = crc16.verify_frames(buffer, chain_offsets, chain_lengths)
+        if not chain_crc_ok.all():
+            # the frames behind a false frame are searched again from its sync byte on
+            failed = int(np.argmin(chain_crc_ok))
+            del chain_offsets[failed + 1:], chain_lengths[failed + 1:]
+            chain_crc_ok = chain_crc_ok[:failed + 1]
+            pos = find_first_frame(buffer, chain_offsets[failed] + 1, end)
+            batch_frames = CHAIN_BATCH_MIN_FRAMES
+        elif broken:
+            pos = find_first_frame(buffer, next_pos + 1, end, disable_crc)
+        else:
+            pos = next_pos
+            batch_frames = min(2*batch_frames, CHAIN_BATCH_MAX_FRAMES)
+        offsets.extend(chain_offsets)
+        lengths.extend(chain_lengths)
+        crc_ok.append(chain_crc_ok)
+    return (np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64),
+            np.concatenate([np.zeros(0, dtype=bool)] + crc_ok), pos)
+
+def iter_frame_ranges(buffer, disable_crc = False, chunk_size = FRAMING_STREAM_CHUNK_SIZE):
+    '''Frames buffer range by range in the calling process
+
+    Gives the same frames as frame_file, see frame_range.
+
+    Yields:
+        Tuples (offsets, lengths, crc_ok) of numpy arrays in file order
+    '''
+    if len(buffer) == 0:
+        return
+    start = MessageSearcher().handle_v5_json(buffer)
+    anchored = True
+    while start < len(buffer):
+        end = min(start + chunk_size, len(buffer))
+        offsets, lengths, crc_ok, next_pos = frame_range(buffer, start, end, anchored, disable_crc)
+        yield offsets, lengths, crc_ok
+        if next_pos is None:
+            start, anchored = end, False
+        else:
+            start, anchored = next_pos, True
+
+def _frame_file_range(filename, start, end, anchored, disable_crc):
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offsets, lengths, crc_ok, next_pos = frame_range(mm, start, end, anchored, disable_crc)
+        finally:
+            mm.close()
+    return offsets, lengths.astype(np.uint16), crc_ok, next_pos
+
+def frame_file(filename='iXCOMstream.bin', workers=None, chunk_size=FRAMING_CHUNK_SIZE, disable_crc=False):
+    '''Frames an XCOMStream file with several processes
+
+    The file is split into byte ranges of chunk_size which are framed by frame_range in a
+    ProcessPoolExecutor. Every range but the first one starts at its first frame found by
+    find_first_frame. The ranges are stitched into one frame list, gaps between the frame
+    chains of neighbouring ranges are framed in the calling process, so the result does not
+    depend on chunk_size.
+
+    Args:
+        filename: Name of the XCOMStream file
+        workers: Number of worker processes, defaults to the number of CPUs
+        chunk_size: Size of the byte ranges
+        disable_crc: Do not check CRCs, see frame_range
+
+    Returns:
+        Tuple (offsets, lengths, crc_ok) of numpy arrays in file order
+    '''
+    file_size = os.path.getsize(filename)
+    if file_size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=bool)
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            first_pos = MessageSearcher().handle_v5_json(mm)
+            starts = [first_pos] + list(range((first_pos // chunk_size + 1) * chunk_size, file_size, chunk_size))
+            ends = starts[1:] + [file_size]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = list(executor.map(_frame_file_range, [filename]*len(starts), starts, ends,
+                                           [True] + [False]*(len(starts) - 1), [disable_crc]*len(starts)))
+            return _stitch_frame_ranges(mm, chunks, first_pos, disable_crc)
+        finally:
+            mm.close()
+
+def _stitch_frame_ranges(buffer, chunks, pos, disable_crc):
+    offsets = [np.zeros(0, dtype=np.int64)]
+    lengths = [np.zeros(0, dtype=np.uint16)]
+    crc_ok = [np.zeros(0, dtype=bool)]
+    for chunk_offsets, chunk_lengths, chunk_crc_ok, next_pos in chunks:
+        idx = 0
+        while pos is not None and idx < len(chunk_offsets) and chunk_offsets[idx] != pos:
+            if chunk_offsets[idx] < pos:
+                idx = int(np.searchsorted(chunk_offsets, pos))
+                continue
+            # the frame chain of the previous range does not meet this one: frame the gap
+            gap_offsets, gap_lengths, gap_crc_ok, pos = frame_range(buffer, pos, int(chunk_offsets[idx]), True, disable_crc)
+            offsets.append(gap_offsets)
+            lengths.append(gap_lengths.astype(np.uint16))
+            crc_ok.append(gap_crc_ok)
+            if pos is None:
+                # the search goes on at the frame of this range, which it finds if it is a valid one
+                pos = int(chunk_offsets[idx])
+                if not (disable_crc or chunk_crc_ok[idx]):
+                    pos = find_first_frame(buffer, pos, len(buffer))
+                    if pos is None:
+                        return np.concatenate(offsets), np.concatenate(lengths), np.concatenate(crc_ok)
+        if idx < len(chunk_offsets):
+            offsets.append(chunk_offsets[idx:])
+            lengths.append(chunk_lengths[idx:])
+            crc_ok.append(chunk_crc_ok[idx:])
+            pos = next_pos
+    return np.concatenate(offsets), np.concatenate(lengths), np.concatenate(crc_ok)
+
+@contextlib.contextmanager
+def map_file(f):
+    '''Maps an opened binary file read-only into memory
+
+    Falls back to reading the file if it cannot be mapped, e.g. for pipes or empty files.
+
+    Yields:
+        memoryview of the file content, which must not be used after leaving the context
+    '''
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError, io.UnsupportedOperation):
+        mm = None
+    if mm is None:
+        yield memoryview(f.read())
+        return
+    view = memoryview(mm)
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+            mm.close()
+        except BufferError:
+            # views are still referenced, e.g. by a traceback; the mapping is closed once they are freed
+            pass
+
+def iter_frame_batches(buffer, filename, disable_crc, workers):
+    '''Yields offsets and lengths of the frames in the mapped file buffer in batches, in file order
+
+    An up-to-date frame index of the file is used instead of framing it unless disable_crc is set,
+    see build_frame_index. With workers == 1 the file is framed range by range by iter_frame_ranges
+    while iterating, otherwise by frame_file up front; both give the same frames. Frames with wrong
+    CRC are left out unless disable_crc is set.
+
+    Yields:
+        Tuples (offsets, lengths) of int64 numpy arrays
+    '''
+    index = None if disable_crc else load_frame_index(filename)
+    if index is None and workers == 1:
+        for offsets, lengths, crc_ok in iter_frame_ranges(buffer, disable_crc):
+            valid = crc_ok | disable_crc
+            yield offsets[valid], lengths[valid]
+        return
+    if index is not None:
+        index = index[np.argsort(index['offset'], kind='stable')]
+        offsets = index['offset'].astype(np.int64)
+        lengths = index['length'].astype(np.int64)
+        crc_ok = index['crc_ok']
+    else:
+        offsets, lengths, crc_ok = frame_file(filename, workers, disable_crc=disable_crc)
+        lengths = lengths.astype(np.int64)
+        if disable_crc:
+            crc_ok[:] = True
+    valid = crc_ok & (lengths > 0)
+    offsets, lengths = offsets[valid], lengths[valid]
+    for batch_start in range(0, len(offsets), GATHER_BATCH_FRAMES):
+        yield offsets[batch_start:batch_start + GATHER_BATCH_FRAMES], lengths[batch_start:batch_start + GATHER_BATCH_FRAMES]
+
+def frame_buffer(buffer, filename, disable_crc, workers):
+    '''Returns offsets and lengths of the frames in the mapped file buffer, see iter_frame_batches'''
+    batches = list(iter_frame_batches(buffer, filename, disable_crc, workers))
+    offsets = np.concatenate([np.zeros(0, dtype=np.int64)] + [batch[0] for batch in batches])
+    lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + [batch[1] for batch in batches])
+    return offsets, lengths
+
+def get_frame_index_filename(filename):
+    return filename + FRAME_INDEX_SUFFIX
+
+def get_recording_fingerprint(filename):
+    '''Returns size, modification time and the CRC of the first and last FINGERPRINT_SAMPLE_BYTES of a recording
+
+    Returns:
+        Array with one record of RECORDING_FINGERPRINT_DTYPE
+    '''
     with open(filename, 'rb') as f:
-        message_searcher.process_buffer_unsafe(f.read())
+        stat = os.fstat(f.fileno())
+        sample = f.read(FINGERPRINT_SAMPLE_BYTES)
+        if stat.st_size > FINGERPRINT_SAMPLE_BYTES:
+            f.seek(max(stat.st_size - FINGERPRINT_SAMPLE_BYTES, FINGERPRINT_SAMPLE_BYTES))
+            sample += f.read(FINGERPRINT_SAMPLE_BYTES)
+    fingerprint = np.zeros(1, dtype=RECORDING_FINGERPRINT_DTYPE)
+    fingerprint['size'] = stat.st_size
+    fingerprint['mtime_ns'] = stat.st_mtime_ns
+    fingerprint['sample_crc'] = crc16.crc16xmodem(sample)
+    return fingerprint
+
+def read_headers(buffer, offsets):
+    '''Returns the headers of the frames at offsets as structured array of HEADER_DTYPE'''
+    in_array = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    headers = np.zeros(len(offsets), dtype=HEADER_DTYPE)
+    complete = np.flatnonzero(offsets + HEADER_DTYPE.itemsize <= len(in_array))
+    header_bytes = headers.view(np.uint8).reshape(-1, HEADER_DTYPE.itemsize)
+    for batch_start in range(0, len(complete), GATHER_BATCH_FRAMES):
+        batch = complete[batch_start:batch_start + GATHER_BATCH_FRAMES]
+        header_bytes[batch] = in_array[offsets[batch, None] + np.arange(HEADER_DTYPE.itemsize)]
+    return headers
+
+def build_frame_index(filename='iXCOMstream.bin', workers=1):
+    '''Frames a recording once and stores its frame index in a sidecar file
+
+    The index holds one FRAME_INDEX_DTYPE record per frame, including frames with wrong CRC. It is
+    sorted by message ID, sub ID (plugin message ID of PLUGIN frames, parameter ID of PARAMETER frames),
+    CRC state, with frames with wrong CRC first, and file offset and saved next to the recording, behind the fingerprint of the recording returned by
+    get_recording_fingerprint. read_file uses the sidecar instead of framing the recording as long as the
+    fingerprint matches.
+
+    Args:
+        filename: Name of the XCOMStream file
+        workers: Number of processes for framing the file, see frame_file
+
+    Returns:
+        The frame index
+    '''
+    fingerprint = get_recording_fingerprint(filename)
+    with open(filename, 'rb') as f, map_file(f) as buffer:
+        if workers == 1:
+            batches = list(iter_frame_ranges(buffer))
+            offsets = np.concatenate([np.zeros(0, dtype=np.int64)] + [batch[0] for batch in batches])
+            lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + [batch[1] for batch in batches])
+            crc_ok = np.concatenate([np.zeros(0, dtype=bool)] + [batch[2] for batch in batches])
+        else:
+            offsets, lengths, crc_ok = frame_file(filename, workers)
+        headers = read_headers(buffer, offsets)
+        sub_ids = read_sub_ids(buffer, offsets, lengths)
+    index = np.zeros(len(offsets), dtype=FRAME_INDEX_DTYPE)
+    index['offset'] = offsets
+    index['msg_id'] = headers['msg_id']
+    index['sub_id'] = sub_ids
+    index['length'] = lengths
+    index['week'] = headers['week']
+    index['time_of_week'] = headers['time_of_week_sec'] + 1e-6 * headers['time_of_week_usec']
+    index['crc_ok'] = crc_ok
+    index = index[np.lexsort((index['offset'], index['crc_ok'], index['sub_id'], index['msg_id']))]
+    with open(get_frame_index_filename(filename), 'wb') as f:
+        np.save(f, fingerprint)
+        np.save(f, index)
+    return index
 
-    for fd in message_files_dict.values():
-        fd.close()
+def load_frame_index(filename='iXCOMstream.bin'):
+    '''Loads the frame index sidecar of a recording memory-mapped
+
+    Returns:
+        The frame index, None if there is no sidecar or the recording has changed since it was built,
+        see get_recording_fingerprint
+    '''
+    index_filename = get_frame_index_filename(filename)
+    try:
+        fingerprint = get_recording_fingerprint(filename)
+        with open(index_filename, 'rb') as f:
+            stored_fingerprint = np.load(f)
+            if stored_fingerprint.dtype != RECORDING_FINGERPRINT_DTYPE or stored_fingerprint.tobytes() != fingerprint.tobytes():
+                return None
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            index_offset = f.tell()
+    except (OSError, ValueError):
+        return None
+    if dtype != FRAME_INDEX_DTYPE or len(shape) != 1:
+        return None
+    if shape[0] == 0:
+        return np.zeros(0, dtype=FRAME_INDEX_DTYPE)
+    return np.memmap(index_filename, dtype=FRAME_INDEX_DTYPE, mode='r', offset=index_offset, shape=shape)
+
+def search_sorted_field(values, value, side = 'left'):
+    '''np.searchsorted for a sorted field of a structured array
+
+    np.searchsorted copies a strided field as a whole, so the block of the position is searched
+    in every INDEX_SEARCH_STEP-th value first and then in the block itself.
+    '''
+    block = int(values[::INDEX_SEARCH_STEP].searchsorted(value, side=side))
+    start = max(block - 1, 0) * INDEX_SEARCH_STEP
+    stop = min(block * INDEX_SEARCH_STEP, len(values))
+    return start + int(values[start:stop].searchsorted(value, side=side))
+
+def query_frame_index(index, msg_id, sub_id = None, start_time = None, end_time = None):
+    '''Selects the frames of one message from a frame index by binary search
+
+    The time range refers to the time of week and assumes the frames of the message to be
+    in chronological order, i.e. a recording within one GPS week. With a time range, only frames
+    with correct CRC are selected, as the time of the others cannot be relied on.
+
+    Args:
+        index: Frame index as returned by build_frame_index or load_frame_index
+        msg_id: Message ID
+        sub_id: Plugin message ID or parameter ID for PLUGIN or PARAMETER frames
+        start_time: Earliest time of week to include
+        end_time: Latest time of week to include
+
+    Returns:
+        The slice of the index with the matching frames, those with wrong CRC first, each in file order
+    '''
+    records = np.asarray(index)
+    def search(field, lo, hi, value, side):
+        return lo + search_sorted_field(records[field][lo:hi], value, side)
+    lo = search('msg_id', 0, len(index), msg_id, 'left')
+    hi = search('msg_id', lo, len(index), msg_id, 'right')
+    if sub_id is not None:
+        lo, hi = search('sub_id', lo, hi, sub_id, 'left'), search('sub_id', lo, hi, sub_id, 'right')
+    if start_time is not None or end_time is not None:
+        lo = search('crc_ok', lo, hi, True, 'left')
+    if start_time is not None:
+        lo = search('time_of_week', lo, hi, start_time, 'left')
+    if end_time is not None:
+        hi = search('time_of_week', lo, hi, end_time, 'right')
+    return index[lo:hi]
+
+def read_sub_ids(buffer, offsets, lengths):
+    '''Returns the plugin message ID of PLUGIN frames and the parameter ID of PARAMETER frames, 0 for other frames'''
+    in_array = np.frombuffer(buffer, dtype=np.uint8)
+    sub_ids = np.zeros(len(offsets), dtype=np.int64)
+    if len(offsets):
+        msg_ids = in_array[offsets + 1]
+        idx = np.flatnonzero(((msg_ids == data.MessageID.PLUGIN) | (msg_ids == data.MessageID.PARAMETER)) & (lengths >= 18))
+        sub_ids[idx] = in_array[offsets[idx] + 16].astype(np.int64) + (in_array[offsets[idx] + 17].astype(np.int64) << 8)
+    return sub_ids
+
+def get_message_ids(buffer, offsets, lengths):
+    '''Returns the message ID of each frame, plugin messages get 0x100 + their plugin message ID'''
+    message_ids = np.frombuffer(buffer, dtype=np.uint8)[offsets + 1].astype(np.int64)
+    plugin_idx = np.flatnonzero((message_ids == data.MessageID.PLUGIN) & (lengths >= 18))
+    message_ids[plugin_idx] = 0x100 + read_sub_ids(buffer, offsets[plugin_idx], lengths[plugin_idx])
+    return message_ids
+
+def group_frames(message_ids):
+    '''Yields (message_id, frame indices) in the order of the first appearance of each message ID'''
+    unique_ids, first_idx, counts = np.unique(message_ids, return_index=True, return_counts=True)
+    frame_idx = np.split(np.argsort(message_ids, kind='stable'), np.cumsum(counts)[:-1])
+    for idx in np.argsort(first_idx).tolist():
+        yield int(unique_ids[idx]), frame_idx[idx]
+
+def gather_frames(buffer, offsets, lengths, out = None):
+    '''Copies the frames at offsets out of buffer into one contiguous uint8 array
+
+    Args:
+        out: uint8 array of the total length of the frames to copy them into, a new array if None
+    '''
+    in_array = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    result = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8) if out is None else out
+    batch_start = 0
+    while batch_start < len(offsets):
+        done = int(ends[batch_start - 1]) if batch_start else 0
+        batch_end = max(int(np.searchsorted(ends, done + GATHER_BATCH_BYTES, side='right')), batch_start + 1)
+        batch_lengths = lengths[batch_start:batch_end]
+        batch_shift = offsets[batch_start:batch_end] - (ends[batch_start:batch_end] - batch_lengths)
+        src_idx = np.arange(done, ends[batch_end - 1], dtype=np.int64) + np.repeat(batch_shift, batch_lengths)
+        np.take(in_array, src_idx, out=result[done:ends[batch_end - 1]])
+        batch_start = batch_end
+    return result
+
+@functools.lru_cache(maxsize=protocol.LAYOUT_CACHE_SIZE)
+def get_timed_dtype(dtype):
+    '''Returns the dtype of decoded frames of dtype: the fields of dtype followed by gpstime'''
+    names = list(dtype.names)
+    return np.dtype({'names': names + ['gpstime'], 'formats': [dtype.fields[name][0] for name in names] + ['<f8']})
+
+def get_record_bytes(records):
+    '''Returns the bytes of a contiguous structured array as writable (records, itemsize) uint8 array'''
+    return records.view(np.uint8).reshape(len(records), records.dtype.itemsize)
+
+def set_time(records):
+    '''Fills the gpstime field of records from their time of week'''
+    records['gpstime'] = records['time_of_week_sec'] + 1e-6 * records['time_of_week_usec']
+    return records
+
+def copy_frames(buffer, offsets, length, records):
+    '''Copies the first length bytes of the frames at offsets in buffer into the leading bytes of records'''
+    in_array = np.frombuffer(buffer, dtype=np.uint8)
+    record_bytes = get_record_bytes(records)
+    columns = np.arange(length, dtype=np.int64)
+    for batch_start in range(0, len(offsets), GATHER_BATCH_FRAMES):
+        batch = slice(batch_start, batch_start + GATHER_BATCH_FRAMES)
+        record_bytes[batch, :length] = in_array[offsets[batch, None] + columns]
+
+class GrowableArray:
+    '''One-dimensional numpy array with amortized constant time appends
+
+    The elements are kept in chunks which grow with the number of elements, so growing never copies
+    the elements appended so far. get() copies the chunks into one array and frees each chunk once it
+    has been copied, so peak memory stays close to the size of the result.
+    '''
+    def __init__(self, dtype, capacity = 0):
+        self.chunks = []
+        self.chunk = np.empty(capacity, dtype=dtype)
+        self.chunk_size = 0
+        self.size = 0
+
+    def extend(self, count):
+        '''Appends count uninitialized elements and returns them as a writable view'''
+        if self.chunk_size + count > len(self.chunk):
+            if self.chunk_size:
+                self.chunks.append(self.chunk[:self.chunk_size])
+            min_count = max(GROWABLE_MIN_CHUNK_BYTES // self.chunk.dtype.itemsize, 1)
+            self.chunk = np.empty(max(count, self.size // GROWABLE_CHUNK_DIVISOR, min_count), dtype=self.chunk.dtype)
+            self.chunk_size = 0
+        view = self.chunk[self.chunk_size:self.chunk_size + count]
+        self.chunk_size += count
+        self.size += count
+        return view
+
+    def append(self, values):
+        self.extend(len(values))[:] = values
+
+    def get(self):
+        '''Returns the appended elements as one array which owns exactly their memory
+
+        Arrays returned earlier stay valid when elements are appended afterwards.
+        '''
+        if self.chunks or self.chunk_size != len(self.chunk):
+            array = np.empty(self.size, dtype=self.chunk.dtype)
+            self.chunks.append(self.chunk[:self.chunk_size])
+            self.chunk = None
+            pos = 0
+            while self.chunks:
+                chunk = self.chunks.pop(0)
+                array[pos:pos + len(chunk)] = chunk
+                pos += len(chunk)
+                del chunk
+            self.chunk = array
+            self.chunk_size = self.size
+        return self.chunk
+
+class MessageFrames:
+    '''Collects the frames of one message ID from a file, see read_file
+
+    Frames of a fixed size message are copied straight into records of get_timed_dtype(dtype). If
+    a frame does not match dtype, or for variable size messages and parameters, the frames are
+    collected as bytes instead.
+    '''
+    def __init__(self, dtype = None):
+        self.dtype = dtype
+        self.records = None if dtype is None else GrowableArray(get_timed_dtype(dtype))
+        self.frame_bytes = GrowableArray(np.uint8)
+        self.lengths = GrowableArray(np.int64)
+
+    def append(self, buffer, offsets, lengths):
+        if self.records is not None:
+            if np.all(lengths == self.dtype.itemsize):
+                copy_frames(buffer, offsets, self.dtype.itemsize, self.records.extend(len(offsets)))
+                return
+            records = self.records.get()
+            self.frame_bytes.append(get_record_bytes(records)[:, :self.dtype.itemsize].reshape(-1))
+            self.lengths.append(np.full(len(records), self.dtype.itemsize, dtype=np.int64))
+            self.records = None
+        gather_frames(buffer, offsets, lengths, out=self.frame_bytes.extend(int(lengths.sum())))
+        self.lengths.append(lengths)
+
+def grep_file(filename='iXCOMstream.bin', disable_crc=False, workers=1):
+    '''Writes the frames of an XCOMStream file into one file per message ID
+
+    The file is memory-mapped and the frames of each message ID are copied straight from the mapping.
+
+    Args:
+        filename: Name of the XCOMStream file
+        disable_crc: Do not drop frames with wrong CRC
+        workers: Number of processes for framing the file, see frame_file. With 1, the file is framed
+            by iter_frame_ranges in the calling process.
+    '''
+    with open(filename, 'rb') as f, map_file(f) as buffer:
+        offsets, lengths = frame_buffer(buffer, filename, disable_crc, workers)
+        message_ids = np.frombuffer(buffer, dtype=np.uint8)[offsets + 1]
+        for message_id, frame_idx in group_frames(message_ids):
+            with open(get_message_filename(message_id), 'wb') as fd:
+                for batch_start in range(0, len(frame_idx), GATHER_BATCH_FRAMES):
+                    batch = frame_idx[batch_start:batch_start + GATHER_BATCH_FRAMES]
+                    fd.write(gather_frames(buffer, offsets[batch], lengths[batch]))
 
 def read_config(filename='config.dump'):
     config = {}
@@ -40,14 +602,14 @@ def read_config(filename='config.dump'):
             config[msg.payload.get_name()] = msg.data
     parser = MessageParser()
     parser.nothrow = True
-    parser.add_callback(parameter_callback)
+    parser.add_callback(parameter_callback, [data.MessageID.PARAMETER])
     with open(filename, 'rb') as f:
         parser.messageSearcher.process_bytes(f.read())
     return config
 
-def read_file_for_config(filename='iXCOMstream.bin'):
+def read_file_for_config(filename='iXCOMstream.bin', disable_crc=False):
     parameter_bytes = io.BytesIO(b'')
-    message_searcher = MessageSearcher(disable_crc = True)
+    message_searcher = MessageSearcher(disable_crc = disable_crc)
 
 
     def message_callback(in_bytes):
@@ -67,113 +629,268 @@ def read_file_for_config(filename='iXCOMstream.bin'):
 
     message_searcher.add_callback(message_callback)
 
-    with open(filename, 'rb') as f:
+    with open(filename, 'rb') as f, map_file(f) as buffer:
         try:
-            message_searcher.process_buffer_unsafe(f.read())
+            message_searcher.process_buffer_unsafe(buffer)
         except EndOfConfig:
             pass
     parameter_bytes.seek(0, os.SEEK_SET)
     parser = MessageParser()
     parser.nothrow = True
-    parser.add_callback(parameter_callback)
+    parser.add_callback(parameter_callback, [data.MessageID.PARAMETER])
     parser.messageSearcher.process_bytes(parameter_bytes.read())
 
     return config
 
-def read_file(filename='iXCOMstream.bin'):
-    message_bytes_dict = dict()
+def read_file(filename='iXCOMstream.bin', disable_crc=False, workers=1, lazy=False):
+    '''Reads an XCOMStream file into one structured numpy array per message
+
+    The file is memory-mapped and framed batch by batch. The frames of each known message are copied
+    straight from the mapping into a growable buffer per message ID, which is decoded in place once the
+    whole file has been read, so peak memory stays close to the size of the result.
+
+    Args:
+        filename: Name of the XCOMStream file
+        disable_crc: Do not drop frames with wrong CRC
+        workers: Number of processes for framing the file, see frame_file. With 1, the file is framed
+            by iter_frame_ranges in the calling process.
+        lazy: Only frame the file and return an XcomDataset which decodes each message on first access
+
+    Returns:
+        Dictionary with the arrays by message name and the configuration under 'config', an
+        XcomDataset with the same keys if lazy is set
+    '''
+    if lazy:
+        return XcomDataset(filename, disable_crc, workers)
     result = dict()
-    message_searcher = MessageSearcher(disable_crc = True)
+    # message ID -> MessageFrames in the order of first appearance, None for messages which are not decoded
+    frames = dict()
+    with open(filename, 'rb') as f, map_file(f) as buffer:
+        for offsets, lengths in iter_frame_batches(buffer, filename, disable_crc, workers):
+            message_ids = get_message_ids(buffer, offsets, lengths)
+            for msg_id, frame_idx in group_frames(message_ids):
+                if msg_id not in frames:
+                    frames[msg_id] = MessageFrames(get_frame_dtype(msg_id)) if is_decodable(msg_id) else None
+                if frames[msg_id] is not None:
+                    frames[msg_id].append(buffer, offsets[frame_idx], lengths[frame_idx])
+    for msg_id, message_frames in frames.items():
+        if message_frames is None:
+            handle_undefined_message(msg_id)
+            continue
+        try:
+            result[get_message_key(msg_id)] = decode_message_frames(msg_id, message_frames)
+        except:
+            print(get_decode_error(msg_id))
+    return result
 
-    def message_callback(in_bytes):
-        if not in_bytes:
-            return
-        message_id = int(in_bytes[1])
-        if message_id == data.MessageID.PLUGIN:
-            plugin_id = int(in_bytes[16]) + (int(in_bytes[17]) << 8)
-            message_id = 0x100 + plugin_id
-        if message_id not in message_bytes_dict:
-            message_bytes_dict[message_id] =  io.BytesIO(b'')
-        message_bytes_dict[message_id].write(in_bytes)
+def get_message_key(msg_id):
+    '''Returns the key of the frames of a decodable message ID in the result of read_file'''
+    if msg_id == data.MessageID.PARAMETER:
+        return 'config'
+    if msg_id > 0xFF:
+        return data.getPluginMessageWithID(msg_id - 0x100).payload.get_name()
+    return data.getMessageWithID(msg_id).payload.get_name()
 
-    config = {}
-    def parameter_callback(msg, from_device):
-        if msg.header.msgID == data.MessageID.PARAMETER:
+def handle_undefined_message(msg_id):
+    '''Reports a message ID which read_file does not decode to the handlers in data'''
+    if msg_id < 0xFD:
+        data.handle_undefined_message(msg_id)
+    elif msg_id > 0xFF:
+        data.handle_undefined_plugin_message(msg_id - 0x100)
+
+def get_decode_error(msg_id):
+    '''Returns the error printed by read_file if the frames of msg_id cannot be decoded'''
+    if msg_id > 0xFF:
+        return f"Error: Plugin Message with ID: {msg_id - 0x100} could not be parsed!"
+    return f"Error: Message with ID: {msg_id} could not be parsed!"
+
+def decode_message_frames(msg_id, message_frames):
+    '''Decodes the MessageFrames of one message ID
+
+    Returns:
+        Structured array, VarsizeRecords for variable size messages or the configuration
+        dictionary for parameters
+    '''
+    if message_frames.records is not None:
+        return set_time(message_frames.records.get())
+    message_bytes = message_frames.frame_bytes.get()
+    if msg_id == data.MessageID.PARAMETER:
+        config = {}
+        def parameter_callback(msg, from_device):
             config[msg.payload.get_name()] = msg.data
-        
+        parser = MessageParser()
+        parser.nothrow = True
+        parser.add_callback(parameter_callback, [data.MessageID.PARAMETER])
+        parser.messageSearcher.process_bytes(message_bytes)
+        return config
+    return parse_message_from_buffer(msg_id, message_bytes, message_frames.lengths.get().tolist())
 
-    message_searcher.add_callback(message_callback)
-    with open(filename, 'rb') as f:
-        message_searcher.process_buffer_unsafe(f.read())
+class XcomDataset(Mapping):
+    '''Messages of an XCOMStream file which are decoded on first access, see read_file
+
+    Opening the dataset only frames the file, or loads its frame index if there is an up-to-date
+    one, and keeps the offsets of the frames of each message. Accessing a message maps the file,
+    copies its frames and decodes them like read_file. The result is cached. The keys are those of the
+    messages with frames, a message which cannot be decoded raises its decode error on access, where
+    read_file leaves it out.
+
+    Attributes:
+        filename: Name of the XCOMStream file
+        frames: Tuple (message ID, offsets, lengths) of the frames by key, in the order of first appearance
+    '''
+    def __init__(self, filename='iXCOMstream.bin', disable_crc=False, workers=1):
+        self.filename = filename
+        self.frames = dict()
+        self._cache = dict()
+        batches = dict()
+        with open(filename, 'rb') as f, map_file(f) as buffer:
+            for offsets, lengths in iter_frame_batches(buffer, filename, disable_crc, workers):
+                message_ids = get_message_ids(buffer, offsets, lengths)
+                for msg_id, frame_idx in group_frames(message_ids):
+                    if msg_id not in batches:
+                        batches[msg_id] = [] if is_decodable(msg_id) else None
+                        if batches[msg_id] is None:
+                            handle_undefined_message(msg_id)
+                    if batches[msg_id] is not None:
+                        batches[msg_id].append((offsets[frame_idx], lengths[frame_idx]))
+        for msg_id, msg_batches in batches.items():
+            if msg_batches is not None:
+                offsets = np.concatenate([batch[0] for batch in msg_batches])
+                lengths = np.concatenate([batch[1] for batch in msg_batches])
+                self.frames[get_message_key(msg_id)] = (msg_id, offsets, lengths)
 
-    for msg_id in message_bytes_dict:
-        message_bytes_dict[msg_id].seek(0, os.SEEK_SET)
-        if msg_id < 0xFD:
-            msg = data.getMessageWithID(msg_id)
+    def __getitem__(self, key):
+        if key not in self._cache:
+            msg_id, offsets, lengths = self.frames[key]
+            message_frames = MessageFrames(get_frame_dtype(msg_id))
+            with open(self.filename, 'rb') as f, map_file(f) as buffer:
+                for batch_start in range(0, len(offsets), GATHER_BATCH_FRAMES):
+                    batch = slice(batch_start, batch_start + GATHER_BATCH_FRAMES)
+                    message_frames.append(buffer, offsets[batch], lengths[batch])
             try:
-                if msg:
-                    result[msg.payload.get_name()] = parse_message_from_buffer(msg_id, message_bytes_dict[msg_id])
-                else:
-                    data.handle_undefined_message(msg_id)
-            except:
-                print(f"Error: Message with ID: {msg_id} could not be parsed!")
-        elif msg_id == data.MessageID.PARAMETER:
-            parser = MessageParser()
-            parser.nothrow = True
-            parser.add_callback(parameter_callback)
-            parser.messageSearcher.process_bytes(message_bytes_dict[msg_id].read())
-            result['config'] = config
-        elif msg_id > 0xFF:
-                plugin_message_id = msg_id - 0x100
-                msg = data.getPluginMessageWithID(plugin_message_id)
-                try:
-                    if msg:
-                        result[msg.payload.get_name()] = parse_message_from_buffer(msg_id, message_bytes_dict[msg_id])
-                    else:
-                        data.handle_undefined_plugin_message(plugin_message_id)
-                except:
-                    print(f"Error: Plugin Message with ID: {plugin_message_id} could not be parsed!")
-    return result
+                self._cache[key] = decode_message_frames(msg_id, message_frames)
+            except Exception:
+                print(get_decode_error(msg_id))
+                raise
+        return self._cache[key]
+
+    def __contains__(self, key):
+        return key in self.frames
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __repr__(self):
+        return f'XcomDataset({self.filename!r}, keys={list(self.frames)!r})'
+
+def get_frame_dtype(msg_id):
+    '''Returns the dtype of the frames of a fixed size message, None for variable size or undecodable messages'''
+    if msg_id == data.MessageID.PARAMETER:
+        return None
+    msg = data.getMessageWithID(msg_id) if msg_id < 0xFD else data.getPluginMessageWithID(msg_id - 0x100)
+    if msg.payload.get_varsize_arg_from_bytes is not None:
+        return None
+    try:
+        return np.dtype(msg.get_numpy_dtype())
+    except Exception:
+        # reported when the frames are decoded
+        return None
+
+def is_decodable(msg_id):
+    '''Tells whether read_file decodes the frames of msg_id, 0x100 + plugin message ID for plugin messages'''
+    if msg_id == data.MessageID.PARAMETER:
+        return True
+    if msg_id < 0xFD:
+        return msg_id in data.MessagePayloadDictionary
+    if msg_id > 0xFF:
+        return msg_id - 0x100 in data.PluginMessagePayloadDictionary
+    return False
+
+def get_message_filename(messageID):
+    '''Returns the name of the file with the frames of messageID written by grep_file'''
+    return '{}.bin'.format(hex(messageID))
+
+def get_payload_field_names(dtype):
+    '''Returns the names of the payload fields of the dtype of a frame'''
+    return [name for name in dtype.names if name not in HEADER_DTYPE.names and name not in ('global_status', 'crc', 'gpstime')]
 
 def parse_message_from_file(messageID, filename = None):
-    msg = data.getMessageWithID(messageID)
+    '''Decodes the frames of one message ID in a file written by grep_file into arrays per field
+
+    The file is memory-mapped and decoded by parse_message_from_buffer. A truncated last frame is
+    ignored. Payload fields which are missing in some frames of a variable size message are NaN
+    in these frames, non-numeric payload fields are left out.
+
+    Args:
+        messageID: Message ID
+        filename: Name of the file, defaults to the file written by grep_file
+
+    Returns:
+        dict with the (frames, 1) arrays gpstime and globalstat and a (frames, field length)
+        float array per payload field
+    '''
     if filename is None:
         fname = hex(messageID).upper()+'.bin'
+        if not os.path.exists(fname):
+            fname = get_message_filename(messageID)
     else:
         fname = filename
-    if messageID != 0x19:
-        msg_size = msg.size()
-    else:
-        with open(fname, mode='rb') as f:
-            msg_size = struct.unpack('=BBBBH', f.read(6))[4]
-    
-    with open(fname, mode='rb') as f:
-        msg.from_bytes(f.read(msg_size))
-
-    file_size = os.path.getsize(fname)
-    
-    num_messages = round(file_size/msg_size)
-    result_dict = dict()
-    result_dict['gpstime'] = np.zeros((num_messages,1))
-    result_dict['globalstat'] = np.zeros((num_messages,1),dtype=np.uint16)
-    for key in msg.payload.data:
-        vector_length = get_item_len(msg.payload.data[key])
-        result_dict[key] = np.zeros((num_messages, vector_length))
-    idx = 0
-    with open(fname, mode='rb') as f:
-        for chunk in iter(lambda: f.read(msg_size), b''):
-            msg.from_bytes(chunk)
-            result_dict['gpstime'][idx] = msg.header.get_time()
-            for key in msg.payload.data:
-                result_dict[key][idx,:] = np.array(msg.payload.data[key])
-            result_dict['globalstat'][idx] = msg.bottom.gStatus
-            idx += 1
+    with open(fname, mode='rb') as f, map_file(f) as buffer:
+        records = parse_message_from_buffer(messageID, buffer)
+        if records is None:
+            return None
+        if isinstance(records, VarsizeRecords):
+            arrays = records.arrays
+            rows = [np.flatnonzero(records.layout == layout_idx) for layout_idx in range(len(arrays))]
+        else:
+            arrays = [records]
+            rows = [slice(None)]
+        num_messages = len(records)
+        result_dict = dict()
+        result_dict['gpstime'] = np.zeros((num_messages, 1))
+        result_dict['globalstat'] = np.zeros((num_messages, 1), dtype=np.uint16)
+        for array, row in zip(arrays, rows):
+            result_dict['gpstime'][row, 0] = array['gpstime']
+            result_dict['globalstat'][row, 0] = array['global_status']
+            for key in get_payload_field_names(array.dtype):
+                if not np.issubdtype(array.dtype[key].base, np.number):
+                    continue
+                field = array[key].reshape(len(array), -1)
+                if key not in result_dict:
+                    result_dict[key] = np.full((num_messages, field.shape[1]), np.nan)
+                result_dict[key][row, :] = field
     return result_dict
 
-def parse_message_from_buffer(messageID, buffer):
- 
-    def add_time(ret):
-        return append_fields(ret, 'gpstime', ret['time_of_week_sec'] + 1e-6 * ret['time_of_week_usec'], usemask=False)
+def get_frame_lengths(buffer):
+    '''Returns the lengths of the consecutive frames in buffer'''
+    frame_lengths = []
+    pos = 0
+    while pos + 6 <= len(buffer):
+        msg_length = buffer[pos + 4] + 256*buffer[pos + 5]
+        if msg_length == 0 or pos + msg_length > len(buffer):
+            break
+        frame_lengths.append(msg_length)
+        pos += msg_length
+    return frame_lengths
+
+def parse_message_from_buffer(messageID, buffer, frame_lengths = None):
+    '''Decodes consecutive frames of one message ID into structured numpy arrays
+
+    Args:
+        messageID: Message ID, 0x100 + plugin message ID for plugin messages
+        buffer: io.BytesIO or bytes-like object with the frames
+        frame_lengths: Lengths of the frames in buffer, e.g. from a frame index. Variable size
+            messages are walked by their length fields if not given.
+
+    Returns:
+        Structured array with a gpstime field, a VarsizeRecords for variable size messages
+    '''
+    if isinstance(buffer, io.BytesIO):
+        buffer = buffer.getbuffer()
+    buffer = memoryview(buffer)
     if messageID > 0xFF:
         plugin_message_id = messageID - 0x100
         msg = data.getPluginMessageWithID(plugin_message_id)
@@ -185,36 +902,31 @@ def parse_message_from_buffer(messageID, buffer):
         
     if msg.payload.get_varsize_arg_from_bytes is None:
         dtype = np.dtype(msg.get_numpy_dtype())
-        nlen = int(np.floor(len(buffer.getbuffer())/ dtype.itemsize))
-        return add_time(np.frombuffer(buffer.getbuffer(), dtype, count=nlen))
+        nlen = int(np.floor(len(buffer)/ dtype.itemsize))
+        records = np.empty(nlen, get_timed_dtype(dtype))
+        get_record_bytes(records)[:, :dtype.itemsize] = np.frombuffer(buffer, np.uint8, nlen*dtype.itemsize).reshape(nlen, dtype.itemsize)
+        return set_time(records)
     else:
-        _next_header = 0
-        _msg_length = 16
-        ret = []
-        while _next_header + _msg_length < len(buffer.getbuffer()):
-            buffer.seek(_next_header)
-            msg.header.from_bytes(buffer.read(16))
-            _msg_length = msg.header.msgLength
-            _varsize_arg = msg.payload.get_varsize_arg_from_bytes(buffer.read(_msg_length - 16 - 4))
-            if messageID > 0xFF:
-                msg = data.getPluginMessageWithID(plugin_message_id,_varsize_arg)
-            else:
-                msg = data.getMessageWithID(messageID,_varsize_arg) 
-            dtype = np.dtype(msg.get_numpy_dtype())
-            buffer.seek(_next_header)
-            ret.append(add_time(np.frombuffer(buffer.read(_msg_length), dtype, count=1)))
-            _next_header += _msg_length
-        return  ret  # normal ndarray not possible because of variable dtypes -> return list
-
-        def iterate(buffer):
-            start = 0
-            while True:
-                try:
-                    current = buffer.getbuffer()[start:]
-                    msg.from_bytes(current)
-                    dtype = msg.get_numpy_dtype()
-                    start += msg.header.msgLength
-                    return add_time(np.frombuffer(current, dtype, count=1))
-                except:
-                    return             
-        return np.hstack(iterate(buffer))
+        if frame_lengths is None:
+            frame_lengths = get_frame_lengths(buffer)
+        lengths = np.asarray(frame_lengths, dtype=np.int64)
+        offsets = np.cumsum(lengths) - lengths
+        # frames are grouped by varsize arg, each group is decoded by one frombuffer call
+        layouts = dict()
+        layout = np.empty(len(lengths), dtype=np.int64)
+        for frame_idx, (_offset, _msg_length) in enumerate(zip(offsets.tolist(), lengths.tolist())):
+            _varsize_arg = msg.payload.get_varsize_arg_from_bytes(buffer[_offset + 16:_offset + _msg_length - 4])
+            layout[frame_idx] = layouts.setdefault(_varsize_arg, len(layouts))
+        arrays = []
+        row = np.empty(len(lengths), dtype=np.int64)
+        for layout_idx, _varsize_arg in enumerate(layouts):
+            dtype = protocol.get_payload_layout(msg.payload, _varsize_arg).get_numpy_dtype()
+            frame_idx = np.flatnonzero(layout == layout_idx)
+            if lengths[frame_idx].min() < dtype.itemsize:
+                raise ValueError(f'Frame too short for the layout of varsize arg {_varsize_arg}')
+            # frames longer than their layout are cut off like single frames decoded by frombuffer
+            records = np.empty(len(frame_idx), get_timed_dtype(dtype))
+            copy_frames(buffer, offsets[frame_idx], dtype.itemsize, records)
+            arrays.append(set_time(records))
+            row[frame_idx] = np.arange(len(frame_idx))
+        return VarsizeRecords(list(layouts), arrays, layout, row)
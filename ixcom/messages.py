@@ -1,7 +1,7 @@
 import struct
 import os
 import json
-from .protocol import Message, PayloadItem, parse_messages_json_folder
+from .protocol import Message, PayloadItem, BytesPayloadItem, parse_messages_json_folder
 from .protocol import ProtocolPayload, message
 from .protocol import DefaultPluginMessagePayload, plugin_message
 from .protocol import MessageID
@@ -259,19 +259,20 @@ class PASSTHROUGH_Payload(ProtocolPayload):
     message_description = Message([
             PayloadItem(name = 'port', dimension = 1, datatype = 'B'),
             PayloadItem(name = 'reserved', dimension = 3, datatype = 'B'),
-            PayloadItem(name='passthroughdata', dimension=256, datatype='B')
+            BytesPayloadItem(name='passthroughdata', dimension=256, datatype='s')
             ])
 
-    def from_bytes(self, inBytes):
-        item_list = [
+    def get_varsize_item_list(self, len_passthroughdata):
+        _item_list = [
             PayloadItem(name = 'port', dimension = 1, datatype = 'B'),
             PayloadItem(name = 'reserved', dimension = 3, datatype = 'B'),
-        ]
-        item_list += [PayloadItem(name='passthroughdata', dimension=len(inBytes[4:]), datatype='B')]
-        #item_list += self._get_payload(port)
-        #item_list += passthrough_data
-        self.message_description = Message(item_list)
-        super().from_bytes(inBytes)
+            BytesPayloadItem(name='passthroughdata', dimension=len_passthroughdata, datatype='s')
+            ]
+        return _item_list
+
+    def get_varsize_arg_from_bytes(self, inBytes):
+        len_passthroughdata = len(inBytes) - 4
+        return len_passthroughdata
 
     def _get_payload(self, stat_mode):
         item_list = []
@@ -1,3 +1,4 @@
+import bisect
 import collections
 import math
 import numpy
@@ -18,6 +19,7 @@ from .exceptions import (ClientTimeoutError, CommunicationError, ParseError,
 from .protocol import ParamID, ProtocolHeader, ProtocolBottom
 
 PositionTuple = collections.namedtuple('PositionTuple', 'Lon Lat Alt')
+SearcherStatistics = collections.namedtuple('SearcherStatistics', 'bytes_consumed bytes_skipped length_rejects frames_published crc_failures resyncs bytes_recovered')
 
 class MessageSearcherState(IntEnum):
     waiting_for_sync = 0
@@ -28,18 +30,130 @@ XCOM_MAX_MESSAGE_LENGTH = 4096
 XCOM_HEADER_LENGTH = ProtocolHeader().size()
 XCOM_BOTTOM_LENGTH = ProtocolBottom().size()
 TOTAL_MAX_MESSAGE_LENGTH = XCOM_MAX_MESSAGE_LENGTH + XCOM_HEADER_LENGTH + XCOM_BOTTOM_LENGTH
+SCAN_BLOCK_SIZE = 1 << 20
+UNSAFE_BATCH_SIZE = 4096
+RESYNC_BUDGET_FACTOR = 4
 
 class MessageSearcher:
-    def __init__(self, parserDelegate = None, disable_crc = False):
+    def __init__(self, parserDelegate = None, disable_crc = False, message_ids = None, plugin_ids = None, parameter_ids = None):
         self.searcherState = MessageSearcherState.waiting_for_sync
-        self.currentBytes = bytearray(512)
-        self.currentByteIdx = 0
-        self.remainingByteCount = 0
-        self.msgLength = 0
+        self.frameBuffer = bytearray(TOTAL_MAX_MESSAGE_LENGTH + 6)
+        self.frameView = memoryview(self.frameBuffer)
+        self.pendingLength = 0
+        self.pendingCrc = crc16.Crc16Xmodem()
+        self.pendingCrcLength = 0
+        self.pendingOffset = 0
+        self.streamOffset = 0
+        self.resyncEnd = 0
+        self.resyncBudget = 0
+        self.chainEnd = -1
         self.disableCRC = disable_crc
         self.callbacks = []
         if parserDelegate is not None:
             self.callbacks.append(parserDelegate.parse)
+        self.set_filter(message_ids, plugin_ids, parameter_ids)
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        '''Resets the counters returned by get_statistics'''
+        self.bytesConsumed = 0
+        self.bytesSkipped = 0
+        self.lengthRejects = 0
+        self.framesPublished = [0]*256
+        self.crcFailures = [0]*256
+        self.resyncs = 0
+        self.bytesRecovered = 0
+
+    def get_statistics(self, reset = False):
+        '''Returns a snapshot of the framing counters
+
+        Args:
+            reset: Reset the counters after taking the snapshot
+
+        Returns:
+            SearcherStatistics with
+                bytes_consumed: Bytes passed to process_bytes or process_buffer_unsafe
+                bytes_skipped: Bytes which did not belong to a frame while searching for the sync byte
+                length_rejects: Sync bytes which were dropped because of an invalid length field
+                frames_published: Dictionary msgID -> number of published frames
+                crc_failures: Dictionary msgID -> number of frames with wrong CRC
+                resyncs: Number of times the search went back behind a false sync byte
+                bytes_recovered: Bytes of published frames which started inside the bytes of a false frame
+        '''
+        frames_published = self.framesPublished
+        crc_failures = self.crcFailures
+        statistics = SearcherStatistics(
+            bytes_consumed = self.bytesConsumed,
+            bytes_skipped = self.bytesSkipped,
+            length_rejects = self.lengthRejects,
+            frames_published = {msg_id: count for msg_id, count in enumerate(frames_published) if count},
+            crc_failures = {msg_id: count for msg_id, count in enumerate(crc_failures) if count},
+            resyncs = self.resyncs,
+            bytes_recovered = self.bytesRecovered,
+        )
+        if reset:
+            self.reset_statistics()
+        return statistics
+
+    def set_filter(self, message_ids = None, plugin_ids = None, parameter_ids = None):
+        '''Restricts the published frames to certain messages
+
+        The filter is applied to the header bytes of a frame, frames which do not pass are
+        skipped before their CRC is checked. None means no restriction.
+
+        Args:
+            message_ids: Message IDs to publish
+            plugin_ids: Plugin message IDs of PLUGIN frames to publish, implies PLUGIN in message_ids
+            parameter_ids: Parameter IDs of PARAMETER frames to publish, implies PARAMETER in message_ids
+        '''
+        self.pluginFilter = None if plugin_ids is None else frozenset(plugin_ids)
+        self.parameterFilter = None if parameter_ids is None else frozenset(parameter_ids)
+        if message_ids is None and plugin_ids is None and parameter_ids is None:
+            self.messageFilter = None
+        elif message_ids is None:
+            self.messageFilter = numpy.ones(256, dtype=bool)
+        else:
+            self.messageFilter = numpy.zeros(256, dtype=bool)
+            self.messageFilter[list(message_ids)] = True
+            if plugin_ids is not None:
+                self.messageFilter[data.MessageID.PLUGIN] = True
+            if parameter_ids is not None:
+                self.messageFilter[data.MessageID.PARAMETER] = True
+
+    def accepts(self, msg_bytes):
+        '''Tells whether a frame passes the filter set by set_filter'''
+        if self.messageFilter is None:
+            return True
+        msg_id = msg_bytes[1]
+        if not self.messageFilter[msg_id]:
+            return False
+        if msg_id == data.MessageID.PLUGIN:
+            sub_ids = self.pluginFilter
+        elif msg_id == data.MessageID.PARAMETER:
+            sub_ids = self.parameterFilter
+        else:
+            return True
+        return sub_ids is None or (len(msg_bytes) >= 18 and msg_bytes[16] + (msg_bytes[17] << 8) in sub_ids)
+
+    def _filter_frames(self, in_array, msg_offsets, msg_lengths):
+        '''Returns a bool array which tells for each frame whether it passes the filter
+
+        Args:
+            in_array: numpy uint8 array with the frames
+            msg_offsets: numpy array with the frame offsets
+            msg_lengths: numpy array with the frame lengths
+        '''
+        msg_ids = in_array[msg_offsets + 1]
+        passes = self.messageFilter[msg_ids]
+        last_sub_id_pos = len(in_array) - 2
+        for msg_id, sub_ids in ((data.MessageID.PLUGIN, self.pluginFilter), (data.MessageID.PARAMETER, self.parameterFilter)):
+            if sub_ids is None:
+                continue
+            idx = numpy.flatnonzero(passes & (msg_ids == msg_id))
+            sub_id_pos = numpy.minimum(msg_offsets[idx] + 16, last_sub_id_pos)
+            frame_sub_ids = in_array[sub_id_pos].astype(numpy.intp) | (in_array[sub_id_pos + 1].astype(numpy.intp) << 8)
+            passes[idx] = numpy.isin(frame_sub_ids, list(sub_ids)) & (msg_lengths[idx] >= 18)
+        return passes
 
     def handle_v5_json(self, inBytes):
         if inBytes[0] == SYNC_BYTE:
@@ -49,10 +163,42 @@ class MessageSearcher:
             return int.from_bytes(inBytes[json_hdr_len_pos:json_hdr_len_pos+4], byteorder='little')
 
     def process_buffer_unsafe(self, buffer):
+        '''Publishes the frames of a buffer which contains nothing but consecutive frames
+
+        The frames are not searched for but follow each other by their length field, so the buffer
+        must not contain partial frames. Unless CRC checking is disabled, frames with a wrong CRC are dropped.
+
+        Args:
+            buffer: bytes-like object, e.g. the content of an XCOMStream file or a memoryview of a mapped file
+        '''
+        inBytes = memoryview(buffer)
+        self.bytesConsumed += inBytes.nbytes
+        for msg_offsets, msg_lengths, crc_ok in self.iter_frames_unsafe(inBytes):
+            for msg_start, msg_length, valid in zip(msg_offsets, msg_lengths, crc_ok):
+                if valid:
+                    self.publish(inBytes[msg_start:msg_start + msg_length])
+
+    def iter_frames_unsafe(self, buffer):
+        '''Locates the frames of a buffer which contains nothing but consecutive frames
+
+        Works like process_buffer_unsafe, but instead of publishing the frames, their positions are
+        yielded in batches. Frames which do not pass the filter are left out, the CRCs of the
+        remaining frames of a batch are verified at once by crc16.verify_frames.
+
+        Args:
+            buffer: bytes-like object
+
+        Yields:
+            Tuples (offsets, lengths, crc_ok) of equally long sequences
+        '''
         current_msg_start_idx = 0
         last_msg_start_id = -1
+        msg_offsets = []
+        msg_lengths = []
         inBytes = memoryview(buffer)
         inbytelen = len(inBytes)
+        if inbytelen == 0:
+            return
         current_msg_start_idx = self.handle_v5_json(inBytes)
         while current_msg_start_idx + 5 < inbytelen:
             
@@ -60,60 +206,272 @@ class MessageSearcher:
 
             if current_msg_start_idx + current_msg_length > inbytelen: # Message nicht mehr komplett
                 break
-            self.publish(inBytes[current_msg_start_idx:current_msg_start_idx+current_msg_length])
+            msg_offsets.append(current_msg_start_idx)
+            msg_lengths.append(current_msg_length)
             if current_msg_start_idx <= last_msg_start_id:
+                yield self._check_frames(inBytes, msg_offsets, msg_lengths)
                 raise Exception("File is corrupted, try xcom-remove-partial-msgs on XCOMStream file")
             last_msg_start_id = current_msg_start_idx
             current_msg_start_idx += current_msg_length
+            if len(msg_offsets) >= UNSAFE_BATCH_SIZE:
+                yield self._check_frames(inBytes, msg_offsets, msg_lengths)
+                msg_offsets = []
+                msg_lengths = []
+        if msg_offsets:
+            yield self._check_frames(inBytes, msg_offsets, msg_lengths)
+
+    def _check_frames(self, buffer, msg_offsets, msg_lengths):
+        if self.messageFilter is not None:
+            msg_offsets = numpy.array(msg_offsets, dtype=numpy.intp)
+            msg_lengths = numpy.array(msg_lengths, dtype=numpy.intp)
+            passes = self._filter_frames(numpy.frombuffer(buffer, dtype=numpy.uint8), msg_offsets, msg_lengths)
+            msg_offsets = msg_offsets[passes].tolist()
+            msg_lengths = msg_lengths[passes].tolist()
+        if self.disableCRC:
+            crc_ok = [True]*len(msg_offsets)
+        else:
+            crc_ok = crc16.verify_frames(buffer, msg_offsets, msg_lengths).tolist()
+            if not all(crc_ok):
+                in_bytes = memoryview(buffer).cast('B')
+                for msg_start, valid in zip(msg_offsets, crc_ok):
+                    if not valid:
+                        self.crcFailures[in_bytes[msg_start + 1]] += 1
+        return msg_offsets, msg_lengths, crc_ok
 
     def process_bytes(self, inBytes):
-        inByteIdx = 0
-        while inByteIdx < len(inBytes):
-            if self.searcherState == MessageSearcherState.waiting_for_sync:
-                poppedByte = inBytes[inByteIdx]
-                inByteIdx += 1
-                if poppedByte == SYNC_BYTE:
-                    self.currentBytes[0] = SYNC_BYTE
-                    self.currentByteIdx = 1
-                    self.remainingByteCount = 5
-                    self.searcherState = MessageSearcherState.waiting_for_msglength
-            elif self.searcherState == MessageSearcherState.waiting_for_msglength:
-                poppedByte = inBytes[inByteIdx]
-                inByteIdx += 1
-                self.currentBytes[self.currentByteIdx] = poppedByte
-                self.currentByteIdx += 1
-                self.remainingByteCount -= 1
-                if self.remainingByteCount == 0:
-                    self.msgLength = self.currentBytes[self.currentByteIdx - 1] * 256 + self.currentBytes[self.currentByteIdx - 2]
-                    self.remainingByteCount = self.msgLength - 6
-                    if self.remainingByteCount < TOTAL_MAX_MESSAGE_LENGTH and self.remainingByteCount > 0:
-                        self.searcherState = MessageSearcherState.fetching_bytes
-                    else:
-                        self.searcherState = MessageSearcherState.waiting_for_sync
-            elif self.searcherState == MessageSearcherState.fetching_bytes:
-                if len(inBytes) - 1 >= self.remainingByteCount + inByteIdx - 1:  # Der Buffer ist Länger als der Rest der Nachricht.
-                    self.currentBytes[self.currentByteIdx:self.currentByteIdx + self.remainingByteCount] = inBytes[inByteIdx:inByteIdx + self.remainingByteCount]
-                    self.currentByteIdx = self.currentByteIdx + self.remainingByteCount
-                    inByteIdx = inByteIdx + self.remainingByteCount
-                    self.remainingByteCount = 0
+        '''Searches inBytes for complete frames and publishes them
+
+        Frames are located block-wise: all sync byte candidates of a block and their length fields
+        are gathered with numpy, so that the Python loop runs once per frame instead of once per byte.
+        A frame that is cut off at the end of inBytes is kept and completed by the next call.
+
+        The CRC of such a frame is updated as its bytes arrive. Frames which do not pass the filter
+        set by set_filter are skipped without checking their CRC as long as they directly follow a
+        valid frame and the next frame follows them directly. On noisy input, a false frame right
+        behind a valid frame may thus hide frames which pass the filter.
+
+        If a sync byte turns out to be false because of an invalid length field or a wrong CRC, the
+        search goes on with the byte after it, so that frames inside the bytes of the false frame are
+        not lost. The bytes searched again after CRC failures are limited to RESYNC_BUDGET_FACTOR
+        times the bytes consumed, which keeps the search linear-time on arbitrary input; once the
+        budget is used up, the search goes on behind a frame with wrong CRC.
+
+        Frames are published as memoryview objects without copying. A frame which lies completely
+        inside inBytes is a view on inBytes itself, a frame which spans two calls is assembled in
+        an internal buffer that is overwritten by the next spanning frame. A published frame is
+        therefore only guaranteed to be valid until the callback returns; callbacks which keep it
+        have to copy it, e.g. with bytes(msg_bytes).
+
+        Args:
+            inBytes: bytes-like object with the next chunk of the stream
+        '''
+        inBytes = memoryview(inBytes).cast('B')
+        self.bytesConsumed += len(inBytes)
+        self.resyncBudget += RESYNC_BUDGET_FACTOR*len(inBytes)
+        chunk_offset = self.streamOffset
+        self.streamOffset += len(inBytes)
+        while True:
+            start_idx = 0
+            if self.pendingLength:
+                start_idx, resync_bytes = self._complete_pending_frame(inBytes)
+                if resync_bytes is not None:
+                    self._scan_chunk(memoryview(resync_bytes), 0, self.pendingOffset + 1)
+                    inBytes = inBytes[start_idx:]
+                    chunk_offset += start_idx
+                    continue
+            if not self.pendingLength:
+                self._scan_chunk(inBytes, start_idx, chunk_offset)
+            break
+        if not self.pendingLength:
+            self.searcherState = MessageSearcherState.waiting_for_sync
+        elif self.pendingLength < 6:
+            self.searcherState = MessageSearcherState.waiting_for_msglength
+        else:
+            self.searcherState = MessageSearcherState.fetching_bytes
+
+    def _scan_chunk(self, inBytes, start_idx, stream_offset):
+        '''Publishes the complete frames of inBytes and keeps the incomplete frame at its end as pending frame'''
+        pending_idx = self._scan_buffer(inBytes, start_idx, stream_offset)
+        self.pendingOffset = stream_offset + pending_idx
+        self.pendingLength = len(inBytes) - pending_idx
+        self.frameBuffer[:self.pendingLength] = inBytes[pending_idx:]
+        self.pendingCrc.reset()
+        self.pendingCrcLength = 0
+        if self.pendingLength >= 6:
+            self._update_pending_crc(self.frameBuffer[4] + 256*self.frameBuffer[5])
+
+    def _complete_pending_frame(self, inBytes):
+        '''Moves the missing bytes of the pending frame from inBytes into the frame buffer
+
+        Publishes the frame if it is complete afterwards.
+
+        Returns:
+            Tuple (consumed, resync_bytes): index of the first byte in inBytes which has not been consumed
+            and, if the sync byte of the pending frame was false, the consumed bytes behind it, else None
+        '''
+        pending_length = self.pendingLength
+        consumed = 0
+        if pending_length < 6:
+            consumed = min(6 - pending_length, len(inBytes))
+            self.frameBuffer[pending_length:pending_length + consumed] = inBytes[:consumed]
+            pending_length += consumed
+            if pending_length < 6:
+                self.pendingLength = pending_length
+                return consumed, None
+        msg_length = self.frameBuffer[4] + 256*self.frameBuffer[5]
+        if not 6 < msg_length < TOTAL_MAX_MESSAGE_LENGTH + 6:
+            self.pendingLength = 0
+            self.lengthRejects += 1
+            self.bytesSkipped += 1
+            self.resyncs += 1
+            if self.pendingOffset >= self.resyncEnd:
+                self.resyncEnd = self.pendingOffset + 6
+            return consumed, bytes(self.frameView[1:pending_length])
+        missing = min(msg_length - pending_length, len(inBytes) - consumed)
+        self.frameBuffer[pending_length:pending_length + missing] = inBytes[consumed:consumed + missing]
+        pending_length += missing
+        consumed += missing
+        self.pendingLength = pending_length
+        self._update_pending_crc(msg_length)
+        if pending_length == msg_length:
+            self.pendingLength = 0
+            msg_bytes = self.frameView[:msg_length]
+            if self.accepts(msg_bytes):
+                frame_ok = self.disableCRC or self.pendingCrc.digest() == msg_bytes[-2] + msg_bytes[-1] * 256
+                if frame_ok:
+                    if self.pendingOffset < self.resyncEnd:
+                        self.bytesRecovered += msg_length
+                    self.publish(msg_bytes)
                 else:
-                    self.currentBytes[self.currentByteIdx:self.currentByteIdx + (len(inBytes) - inByteIdx)] = inBytes[inByteIdx:]
-                    self.currentByteIdx = self.currentByteIdx + (len(inBytes) - inByteIdx)
-                    self.remainingByteCount -= (len(inBytes) - inByteIdx)
-                    inByteIdx = len(inBytes)
-                if self.remainingByteCount == 0:
-                    if self.disableCRC:
-                        self.publish(self.currentBytes[:self.currentByteIdx])
-                    else:
-                        crc = crc16.crc16xmodem(bytes(self.currentBytes[:self.currentByteIdx - 2]))
-                        if crc == self.currentBytes[self.currentByteIdx - 2] + self.currentBytes[
-                                    self.currentByteIdx - 1] * 256:
-                            self.publish(self.currentBytes[:self.currentByteIdx])
-                        else:
-                            pass
-                    self.searcherState = MessageSearcherState.waiting_for_sync
+                    self.crcFailures[msg_bytes[1]] += 1
+            else:
+                frame_ok = (self.pendingOffset == self.chainEnd and consumed < len(inBytes) and inBytes[consumed] == SYNC_BYTE) \
+                    or self._check_crc(msg_bytes)
+            if frame_ok:
+                self.chainEnd = self.pendingOffset + msg_length
+            if not frame_ok and self.resyncBudget >= msg_length:
+                self.resyncBudget -= msg_length
+                self.bytesSkipped += 1
+                self.resyncs += 1
+                if self.pendingOffset >= self.resyncEnd:
+                    self.resyncEnd = self.pendingOffset + msg_length
+                return consumed, bytes(msg_bytes[1:])
+        return consumed, None
+
+    def _update_pending_crc(self, msg_length):
+        '''Feeds the bytes of the pending frame which arrived since the last call into its CRC'''
+        if self.disableCRC or (self.messageFilter is not None and not self.messageFilter[self.frameBuffer[1]]):
+            return
+        crc_end = min(self.pendingLength, msg_length - 2)
+        if crc_end > self.pendingCrcLength:
+            self.pendingCrc.update(self.frameView[self.pendingCrcLength:crc_end])
+            self.pendingCrcLength = crc_end
+
+    def _scan_buffer(self, buffer, start_idx = 0, stream_offset = 0):
+        '''Publishes all complete frames in buffer, starting at start_idx
+
+        Args:
+            buffer: memoryview of the bytes to search
+            start_idx: Index to start the search at
+            stream_offset: Position of buffer in the stream, frames starting before the end of the last
+                false frame (self.resyncEnd) would have been skipped by searching on behind the false
+                frame and are counted as recovered
+
+        Returns:
+            Index of the first byte which belongs to an incomplete frame, len(buffer) if there is none
+        '''
+        in_array = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        buffer_len = len(in_array)
+        pos = start_idx
+        block_start = start_idx
+        pending_idx = buffer_len
+        resync_end = self.resyncEnd - stream_offset
+        chain_end = self.chainEnd - stream_offset
+        while block_start < buffer_len:
+            block_end = min(block_start + SCAN_BLOCK_SIZE, buffer_len)
+            sync_positions = numpy.flatnonzero(in_array[block_start:block_end] == SYNC_BYTE) + block_start
+            header_positions = sync_positions[sync_positions + 5 < buffer_len]
+            msg_lengths = in_array[header_positions + 4].astype(numpy.intp) | (in_array[header_positions + 5].astype(numpy.intp) << 8)
+            passes = None
+            if self.messageFilter is not None:
+                passes = self._filter_frames(in_array, header_positions, msg_lengths).tolist()
+            sync_positions = sync_positions.tolist()
+            msg_lengths = msg_lengths.tolist()
+            num_headers = len(msg_lengths)
+            idx = 0
+            while True:
+                idx = bisect.bisect_left(sync_positions, pos, idx)
+                if idx >= num_headers:
+                    break
+                msg_start = sync_positions[idx]
+                msg_length = msg_lengths[idx]
+                self.bytesSkipped += msg_start - pos
+                if not 6 < msg_length < TOTAL_MAX_MESSAGE_LENGTH + 6:
+                    self.lengthRejects += 1
+                    self.bytesSkipped += 1
+                    self.resyncs += 1
+                    if msg_start >= resync_end:
+                        resync_end = msg_start + 6
+                    pos = msg_start + 1
+                    continue
+                msg_end = msg_start + msg_length
+                if msg_end > buffer_len:
+                    pos = pending_idx = msg_start
+                    break
+                msg_bytes = buffer[msg_start:msg_end]
+                if passes is None or passes[idx]:
+                    frame_ok = self._check_and_publish(msg_bytes, msg_start < resync_end)
+                else:
+                    # Frames which do not pass the filter are only checked if they do not continue
+                    # a chain of valid frames or no frame follows them
+                    frame_ok = (msg_start == chain_end and msg_end < buffer_len and buffer[msg_end] == SYNC_BYTE) \
+                        or self._check_crc(msg_bytes)
+                if frame_ok:
+                    pos = chain_end = msg_end
+                elif self.resyncBudget >= msg_length:
+                    self.resyncBudget -= msg_length
+                    self.bytesSkipped += 1
+                    self.resyncs += 1
+                    if msg_start >= resync_end:
+                        resync_end = msg_end
+                    pos = msg_start + 1
+                else:
+                    pos = msg_end
+            if pending_idx < buffer_len:
+                break
+            if idx < len(sync_positions):
+                self.bytesSkipped += sync_positions[idx] - pos
+                pos = pending_idx = sync_positions[idx]
+                break
+            if pos < block_end:
+                self.bytesSkipped += block_end - pos
+                pos = block_end
+            block_start = pos
+        self.resyncEnd = resync_end + stream_offset
+        self.chainEnd = chain_end + stream_offset
+        return pending_idx
+
+    def _check_crc(self, msg_bytes):
+        if self.disableCRC or crc16.crc16xmodem(msg_bytes[:-2]) == msg_bytes[-2] + msg_bytes[-1] * 256:
+            return True
+        self.crcFailures[msg_bytes[1]] += 1
+        return False
+
+    def _check_and_publish(self, msg_bytes, recovered = False):
+        '''Publishes msg_bytes if its CRC is correct
+
+        Returns:
+            True if the frame has been published
+        '''
+        if not self._check_crc(msg_bytes):
+            return False
+        if recovered:
+            self.bytesRecovered += len(msg_bytes)
+        self.publish(msg_bytes)
+        return True
 
     def publish(self, msg_bytes):
+        self.framesPublished[msg_bytes[1]] += 1
         for callback in self.callbacks:
             callback(msg_bytes)
 
@@ -124,12 +482,185 @@ class MessageSearcher:
         self.callbacks.remove(callback)
 
 
+def get_message_id(message):
+    '''Returns the message ID of a ProtocolMessage or a numpy record published by MessageParser'''
+    if isinstance(message, numpy.void):
+        return int(message['msg_id'])
+    return message.header.msgID
+
 class MessageParser:
-    def __init__(self):
+    '''Decodes frames into ProtocolMessage objects and publishes them
+
+    With pool_messages set, the parser keeps one message object per message type and refills it
+    in place for every frame of that type instead of constructing new objects. A published message
+    is then only valid until the callback returns; callbacks which keep a message have to keep
+    retain(message) instead.
+
+    With numpy_records set, messages and plugin messages are published as numpy.void records of
+    the dtype returned by ProtocolMessage.get_numpy_dtype instead, which is cached per message ID.
+    A record is a view on the frame bytes, so the same rule applies. Responses, parameters and
+    commands are still published as ProtocolMessage objects.
+
+    With lazy_messages set, messages and plugin messages are published as LazyProtocolMessage
+    objects, which decode a payload field on its first access.
+
+    Subscribers and callbacks can be restricted to a set of message IDs. Frames are dispatched by
+    message ID through a table holding only the IDs somebody receives; other frames are dropped
+    before any object is constructed. Subclasses which override publish receive all messages.
+    '''
+    def __init__(self, pool_messages = False, numpy_records = False, lazy_messages = False):
         self.subscribers = set()
+        self.subscriberIDs = dict()
         self.callbacks = list()
+        self.callbackIDs = list()
         self.messageSearcher = MessageSearcher(self)
         self.nothrow = False
+        self.poolMessages = pool_messages
+        self.messagePool = dict()
+        self.numpyRecords = numpy_records
+        self.lazyMessages = lazy_messages
+        self.recordLayouts = dict()
+        self.batchCallbacks = list()
+        self.batchFrames = None
+        self.update_routes()
+
+    def retain(self, message):
+        '''Returns a message that stays valid after the callback, a copy of pooled messages and records'''
+        if isinstance(message, numpy.void) or self.poolMessages:
+            return message.copy()
+        return message
+
+    def get_record_dtype(self, inBytes):
+        '''Returns the numpy dtype for the records of the message in frame inBytes, None for unknown messages
+
+        The dtypes are taken from the payload layout cache of the protocol module.
+        '''
+        layout = self._get_record_layout(inBytes)
+        if layout is None:
+            return None
+        return layout[2]
+
+    def _get_record_layout(self, inBytes):
+        '''Returns the tuple (payload, varsize_arg, dtype) for the message in frame inBytes, None for unknown messages'''
+        msgID, _, plugin_message_id, _, _ = protocol.peek_header(inBytes)
+        if msgID == data.MessageID.PLUGIN:
+            key = 0x100 + plugin_message_id
+        else:
+            key = msgID
+        payload = self.recordLayouts.get(key)
+        if payload is None:
+            if msgID == data.MessageID.PLUGIN:
+                message = data.getPluginMessageWithID(plugin_message_id)
+                if message is None:
+                    data.handle_undefined_plugin_message(plugin_message_id)
+                    return None
+            else:
+                message = data.getMessageWithID(msgID)
+                if message is None:
+                    return None
+            payload = self.recordLayouts[key] = message.payload
+        varsize_arg = None
+        if payload._is_varsize():
+            varsize_arg = payload.get_varsize_arg_from_bytes(inBytes[16:len(inBytes) - 4])
+        dtype = protocol.get_payload_layout(payload, varsize_arg).get_numpy_dtype()
+        return payload, varsize_arg, dtype
+
+    def parse_many(self, frames):
+        '''Decodes a batch of frames into structured arrays
+
+        Frames of messages and plugin messages are grouped by message ID, plugin message ID and varsize
+        argument, and each group is decoded by a single numpy.frombuffer call. Responses, parameters and
+        commands are parsed and published one by one as by parse.
+
+        Args:
+            frames: Iterable of frames, bytes-like objects
+
+        Returns:
+            Dictionary payload name -> structured array with one record per frame. Variable size
+            messages get a VarsizeRecords with one array per varsize argument instead.
+        '''
+        groups = dict()
+        for frame_idx, frame in enumerate(frames):
+            if frame[1] in (data.MessageID.RESPONSE, data.MessageID.PARAMETER, data.MessageID.COMMAND):
+                self.parse(frame)
+                continue
+            layout = self._get_record_layout(frame)
+            if layout is None:
+                continue
+            payload, varsize_arg, dtype = layout
+            if len(frame) != dtype.itemsize:
+                err = ParseError('Frame length {} does not match message with ID {}'.format(len(frame), frame[1]))
+                if self.nothrow:
+                    print(err)
+                    continue
+                raise err
+            group_key = (id(dtype), varsize_arg)
+            if group_key not in groups:
+                groups[group_key] = (payload, varsize_arg, dtype, [], [])
+            groups[group_key][3].append(frame_idx)
+            groups[group_key][4].append(frame)
+        result = dict()
+        varsize_groups = dict()
+        for payload, varsize_arg, dtype, frame_indices, group_frames in groups.values():
+            records = numpy.frombuffer(b''.join(group_frames), dtype)
+            if payload._is_varsize():
+                varsize_groups.setdefault(payload.get_name(), []).append((varsize_arg, records, frame_indices))
+            else:
+                result[payload.get_name()] = records
+        for name, name_groups in varsize_groups.items():
+            frame_idx = numpy.concatenate([numpy.array(frame_indices, dtype=numpy.int64) for _, _, frame_indices in name_groups])
+            layout = numpy.concatenate([numpy.full(len(frame_indices), layout_idx, dtype=numpy.int64)
+                                        for layout_idx, (_, _, frame_indices) in enumerate(name_groups)])
+            row = numpy.concatenate([numpy.arange(len(frame_indices), dtype=numpy.int64) for _, _, frame_indices in name_groups])
+            order = numpy.argsort(frame_idx, kind='stable')
+            result[name] = protocol.VarsizeRecords([varsize_arg for varsize_arg, _, _ in name_groups],
+                                                   [records for _, records, _ in name_groups], layout[order], row[order])
+        return result
+
+    def process_batch(self, inBytes):
+        '''Searches inBytes for frames like MessageSearcher.process_bytes and decodes them as one batch
+
+        Frames of messages which subscribers or callbacks receive are parsed and published one by one
+        as by parse, the other messages are decoded by parse_many and handed to the batch callbacks at once.
+        '''
+        self.batchFrames = []
+        try:
+            self.messageSearcher.process_bytes(inBytes)
+        finally:
+            frames, self.batchFrames = self.batchFrames, None
+        records = self.parse_many(frames)
+        if records:
+            self.publish_batch(records)
+
+    def parse_record(self, inBytes):
+        dtype = self.get_record_dtype(inBytes)
+        if dtype is None:
+            return
+        if len(inBytes) != dtype.itemsize:
+            raise ParseError('Frame length {} does not match message with ID {}'.format(len(inBytes), inBytes[1]))
+        self.publish(numpy.frombuffer(inBytes, dtype, count=1)[0])
+
+    def _get_message(self, key, create_message, message_id):
+        '''Returns the pooled message for key, creates it by create_message(message_id) if necessary'''
+        if not self.poolMessages:
+            return create_message(message_id)
+        message = self.messagePool.get(key)
+        if message is None:
+            message = create_message(message_id)
+            if message is not None:
+                self.messagePool[key] = message
+        return message
+
+    def _create_lazy_message(self, create_message):
+        '''Wraps create_message to return LazyProtocolMessage objects if lazy_messages is set'''
+        if not self.lazyMessages:
+            return create_message
+        def create_lazy_message(message_id):
+            message = create_message(message_id)
+            if message is not None:
+                message = protocol.LazyProtocolMessage.wrap(message)
+            return message
+        return create_lazy_message
 
     def parse_response(self, inBytes):
         message = data.ProtocolMessage()
@@ -139,12 +670,12 @@ class MessageParser:
         self.publish(message)
 
     def parse_parameter(self, inBytes):
-        parameterID = inBytes[16] + (inBytes[17] << 8)
+        _, _, parameterID, _, _ = protocol.peek_header(inBytes)
         if parameterID != ParamID.PARPLUGIN:
-            message = data.getParameterWithID(parameterID)
+            message = self._get_message(('parameter', parameterID), data.getParameterWithID, parameterID)
         else:
-            pluginParameterID = inBytes[22] + (inBytes[23] << 8)
-            message = data.getPluginParameterWithID(pluginParameterID)
+            pluginParameterID = protocol.SUB_ID_STRUCT.unpack_from(inBytes, 22)[0]
+            message = self._get_message(('plugin_parameter', pluginParameterID), data.getPluginParameterWithID, pluginParameterID)
         if message is not None:
             try:
                 message.from_bytes(inBytes)
@@ -155,8 +686,8 @@ class MessageParser:
             data.handle_undefined_parameter(parameterID)
 
     def parse_command(self, inBytes):
-        cmdID = inBytes[16] + (inBytes[17] << 8)
-        message = data.getCommandWithID(cmdID)
+        _, _, cmdID, _, _ = protocol.peek_header(inBytes)
+        message = self._get_message(('command', cmdID), data.getCommandWithID, cmdID)
         if message is not None:
             message.from_bytes(inBytes)
             self.publish(message)
@@ -164,8 +695,8 @@ class MessageParser:
             pass
 
     def parse_plugin_message(self, inBytes):
-        plugin_message_id = inBytes[16] + (inBytes[17] << 8)
-        message = data.getPluginMessageWithID(plugin_message_id)
+        _, _, plugin_message_id, _, _ = protocol.peek_header(inBytes)
+        message = self._get_message(('plugin', plugin_message_id), self._create_lazy_message(data.getPluginMessageWithID), plugin_message_id)
         if message is not None:
             try:
                 message.from_bytes(inBytes)
@@ -176,54 +707,129 @@ class MessageParser:
             data.handle_undefined_plugin_message(plugin_message_id)
 
 
+    def parse_default_message(self, inBytes):
+        msgID = inBytes[1]
+        message = self._get_message(msgID, self._create_lazy_message(data.getMessageWithID), msgID)
+        if message is not None:
+            message.from_bytes(inBytes)
+            self.publish(message)
+
+    def get_handler(self, msgID):
+        '''Returns the parse method for frames with message ID msgID'''
+        if msgID == data.MessageID.RESPONSE:
+            return self.parse_response
+        if msgID == data.MessageID.PARAMETER:
+            return self.parse_parameter
+        if msgID == data.MessageID.COMMAND:
+            return self.parse_command
+        if self.numpyRecords:
+            return self.parse_record
+        if msgID == data.MessageID.PLUGIN:
+            return self.parse_plugin_message
+        return self.parse_default_message
+
+    def update_routes(self):
+        '''Rebuilds the receivers and the dispatch table per message ID after subscriptions changed
+
+        If a subclass overrides publish, the dispatch table holds all message IDs, as the overriding
+        publish may handle messages nobody subscribed to.
+        '''
+        routes = dict()
+        for msgID in range(256):
+            subscribers = [subscriber for subscriber in self.subscribers if self._receives(self.subscriberIDs.get(subscriber), msgID)]
+            callbacks = [callback for callback, ids in zip(self.callbacks, self.callbackIDs) if self._receives(ids, msgID)]
+            if subscribers or callbacks:
+                routes[msgID] = (subscribers, callbacks)
+        self.routes = routes
+        dispatched_ids = range(256) if self._publishes_all() else routes
+        self.dispatchTable = {msgID: self.get_handler(msgID) for msgID in dispatched_ids}
+
+    def _publishes_all(self):
+        return type(self).publish not in (MessageParser.publish, Client.publish)
+
+    @staticmethod
+    def _receives(message_ids, msgID):
+        return message_ids is None or msgID in message_ids
+
     def parse(self, inBytes):
-        header = data.ProtocolHeader()
-        header.from_bytes(inBytes)
+        msgID = inBytes[1]
+        handler = self.dispatchTable.get(msgID)
+        if handler is None:
+            if self.batchFrames is not None and msgID not in (data.MessageID.RESPONSE, data.MessageID.PARAMETER, data.MessageID.COMMAND):
+                self.batchFrames.append(bytes(inBytes))
+            return
         try:
-            if header.msgID == data.MessageID.RESPONSE:
-                self.parse_response(inBytes)
-            elif header.msgID == data.MessageID.PARAMETER:
-                self.parse_parameter(inBytes)
-            elif header.msgID == data.MessageID.COMMAND:
-                self.parse_command(inBytes)
-            elif header.msgID == data.MessageID.PLUGIN:
-                self.parse_plugin_message(inBytes)
-            else:
-                message = data.getMessageWithID(header.msgID)
-                if message is not None:
-                    message.from_bytes(inBytes)
-                    self.publish(message)
+            handler(inBytes)
         except ParseError as err:
             if self.nothrow:
                 print(err)
             else:
                 raise
 
-    def add_subscriber(self, subscriber):
+    def add_subscriber(self, subscriber, message_ids = None):
+        '''Adds a subscriber, its handle_message is called for each published message
+
+        Args:
+            subscriber: Object with a method handle_message(message, from_device)
+            message_ids: Message IDs the subscriber receives, all if None
+        '''
         self.subscribers.add(subscriber)
+        self.subscriberIDs[subscriber] = None if message_ids is None else frozenset(message_ids)
+        self.update_routes()
 
-    def add_callback(self, callback):
+    def add_callback(self, callback, message_ids = None):
+        '''Adds a callback, which is called with each published message and from_device
+
+        Args:
+            callback: Callable callback(message, from_device)
+            message_ids: Message IDs the callback receives, all if None
+        '''
         self.callbacks += [callback]
+        self.callbackIDs += [None if message_ids is None else frozenset(message_ids)]
+        self.update_routes()
 
-    def add_callback_and_block(self, callback):
+    def add_callback_and_block(self, callback, message_ids = None):
         '''Add a callback function and joins the communication thread.
         Call stop() in a callback function the stop the communication thread and continue.
         '''
-        self.callbacks += [callback]
+        self.add_callback(callback, message_ids)
         self.join_comm_thread.join()
 
     def remove_callback(self, callback):
-        self.callbacks.remove(callback)
+        idx = self.callbacks.index(callback)
+        del self.callbacks[idx]
+        del self.callbackIDs[idx]
+        self.update_routes()
 
     def remove_subscriber(self, subscriber):
         self.subscribers.discard(subscriber)
+        self.subscriberIDs.pop(subscriber, None)
+        self.update_routes()
 
     def publish(self, message):
-        for subscriber in self.subscribers:
+        route = self.routes.get(get_message_id(message))
+        if route is None:
+            return
+        subscribers, callbacks = route
+        for subscriber in subscribers:
             subscriber.handle_message(message, from_device=self)
-        for callback in self.callbacks:
+        for callback in callbacks:
             callback(message, from_device=self)
 
+    def add_batch_callback(self, callback):
+        '''Adds a callback for the batches decoded by process_batch
+
+        The callback is called with the dictionary returned by parse_many and from_device.
+        '''
+        self.batchCallbacks += [callback]
+
+    def remove_batch_callback(self, callback):
+        self.batchCallbacks.remove(callback)
+
+    def publish_batch(self, records):
+        for callback in self.batchCallbacks:
+            callback(records, from_device=self)
+
 class MessageCallback:
     def __init__(self, callback, msg, client):
         self.callback = callback
@@ -233,15 +839,70 @@ class MessageCallback:
     def run(self):
         self.callback(self.msg, self.client)
 
+class PassthroughStreams:
+    '''Reassembles the byte streams tunneled through PASSTHROUGH messages
+
+    Add an instance as subscriber to a MessageParser or Client. The passthrough data of each
+    message is appended to the stream of its port, e.g. to feed an RTCM or NMEA decoder.
+    '''
+    def __init__(self, ports = None):
+        self.ports = None if ports is None else frozenset(ports)
+        self.streams = collections.defaultdict(bytearray)
+        self.lock = threading.Lock()
+
+    def handle_message(self, message, from_device = None):
+        if get_message_id(message) != data.PASSTHROUGH_Payload.message_id:
+            return
+        if isinstance(message, numpy.void):
+            self.feed(int(message['port']), message['passthroughdata'].tobytes())
+        else:
+            self.feed(message.payload.data['port'], message.payload.data['passthroughdata'])
+
+    def feed(self, port, chunk):
+        '''Appends chunk to the stream of port'''
+        if self.ports is not None and port not in self.ports:
+            return
+        with self.lock:
+            self.streams[port] += chunk
+
+    def available(self, port):
+        '''Returns the number of buffered bytes of port'''
+        with self.lock:
+            return len(self.streams.get(port, b''))
+
+    def read(self, port, size = -1):
+        '''Removes and returns up to size buffered bytes of port
+
+        Args:
+            port: Passthrough port
+            size: Maximum number of bytes, all buffered bytes if negative
+        Returns:
+            The bytes read
+        '''
+        with self.lock:
+            stream = self.streams.get(port)
+            if not stream:
+                return b''
+            if size < 0 or size >= len(stream):
+                size = len(stream)
+            result = bytes(memoryview(stream)[:size])
+            del stream[:size]
+            return result
+
 class Client(MessageParser):
     '''XCOM TCP Client
 
     Implements a TCP-socket based XCOM client and offers convenience methods to interact with the 
-    device. Other classes may subscribe to decoded messages.
+    device. Other classes may subscribe to decoded messages. The client itself only receives
+    responses, parameters and awaited messages, unless a subclass overrides handle_message.
+
+    Once a batch callback has been added, the data of each recv is decoded as one batch by
+    process_batch; messages which subscribers or callbacks receive, e.g. the message awaited
+    by poll_log, are still published one by one.
     '''
 
-    def __init__(self, host, port=GENERAL_PORT, timeout = WAIT_TIME_FOR_RESPONSE):
-        MessageParser.__init__(self)
+    def __init__(self, host, port=GENERAL_PORT, timeout = WAIT_TIME_FOR_RESPONSE, pool_messages = False, numpy_records = False, lazy_messages = False):
+        MessageParser.__init__(self, pool_messages, numpy_records, lazy_messages)
         self.timeout = timeout
         self.host = host
         self.port = port
@@ -263,7 +924,13 @@ class Client(MessageParser):
         
         self._callback_thread.start()
         
-        self.add_subscriber(self)
+        self._subscribe_self([data.MessageID.RESPONSE, data.MessageID.PARAMETER])
+
+    def _subscribe_self(self, message_ids):
+        '''Subscribes the client to message_ids, subclasses which override handle_message to all messages'''
+        if type(self).handle_message is not Client.handle_message:
+            message_ids = None
+        self.add_subscriber(self, message_ids)
 
     def _create_socket_and_connect(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -289,18 +956,39 @@ class Client(MessageParser):
     def get_open_channel(self):
         return self._open_channel
 
+    def get_statistics(self, reset = False):
+        '''Returns a snapshot of the framing counters of the received stream
+
+        See MessageSearcher.get_statistics.
+        '''
+        return self.messageSearcher.get_statistics(reset)
+
+    def reset_statistics(self):
+        self.messageSearcher.reset_statistics()
+
     def stop(self):
         self._stop_event.set()
         self._comm_thread.join()
         self._callback_thread.join()
 
     def publish(self, message):
-        for subscriber in self.subscribers:
+        route = self.routes.get(get_message_id(message))
+        if route is None:
+            return
+        subscribers, callbacks = route
+        for subscriber in subscribers:
             subscriber.handle_message(message, from_device=self)
-        for callback in self.callbacks:
+        if callbacks:
+            # Callbacks run on the callback thread, possibly after the message has been refilled
+            message = self.retain(message)
+        for callback in callbacks:
             cb = MessageCallback(callback, message, self)
             self._callback_queue.put(cb)
 
+    def publish_batch(self, records):
+        for callback in self.batchCallbacks:
+            self._callback_queue.put(MessageCallback(callback, records, self))
+
     def __hash__(self):
         '''Hash function
 
@@ -324,15 +1012,22 @@ class Client(MessageParser):
             except queue.Empty:
                 pass
         
+    def _expect_message(self, msgID):
+        '''Prepares _message_event for the next message with ID msgID and subscribes to it'''
+        self._message_event.id = msgID
+        self._message_event.clear()
+        self._subscribe_self([data.MessageID.RESPONSE, data.MessageID.PARAMETER, msgID])
+
     def handle_message(self, message, from_device):
-       if message.header.msgID == data.MessageID.RESPONSE:
-           self._response_event.response = message
+       msgID = get_message_id(message)
+       if msgID == data.MessageID.RESPONSE:
+           self._response_event.response = self.retain(message)
            self._response_event.set()
-       elif message.header.msgID == data.MessageID.PARAMETER:           
-           self._parameter_event.parameter = message
+       elif msgID == data.MessageID.PARAMETER:           
+           self._parameter_event.parameter = self.retain(message)
            self._parameter_event.set()
-       elif message.header.msgID == self._message_event.id:
-           self._message_event.msg = message
+       elif msgID == self._message_event.id:
+           self._message_event.msg = self.retain(message)
            self._message_event.set()
         
 
@@ -364,7 +1059,10 @@ class Client(MessageParser):
                         _data = self.sock.recv(2048)
                         if len(_data) >= 1024:
                             print('max bytes read:', len(_data))
-                        self.messageSearcher.process_bytes(_data)
+                        if self.batchCallbacks:
+                            self.process_batch(_data)
+                        else:
+                            self.messageSearcher.process_bytes(_data)
                         # self.messageSearcher.process_bytes(self.sock.recv(1024))
                     except OSError:
                         pass
@@ -801,8 +1499,7 @@ class Client(MessageParser):
         msgToSend.payload.data['trigger'] = data.LogTrigger.POLLED
         msgToSend.payload.data['parameter'] = data.LogCommand.ADD
         msgToSend.payload.data['divider'] = 500  # use 500 here, because a '1' is rejected from some logs
-        self._message_event.id = msgID
-        self._message_event.clear()
+        self._expect_message(msgID)
         self.send_msg_and_waitfor_okay(msgToSend)
         return self.wait_for_polled_log()
 
@@ -851,8 +1548,7 @@ class Client(MessageParser):
             ClientTimeoutError: Timeout while waiting for message from the XCOM server
         
         '''
-        self._message_event.id = msgID
-        self._message_event.clear()
+        self._expect_message(msgID)
         self._update_until_event(self._message_event, self.timeout)
         result = self._message_event.msg
         return result
@@ -1342,11 +2038,10 @@ class Client(MessageParser):
             ClientTimeoutError: Timeout while waiting for response or log from the XCOM server
             ResponseError: The response from the system was not 'OK'.
         '''
-        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id)
+        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id, 3)
         msgToSend.payload.data['time'] = time
         msgToSend.payload.data['timeMode'] = timeMode
         msgToSend.payload.data['cmdParamID'] = 3
-        msgToSend.payload.structString += '12dI'
         msgToSend.payload.data['lon'] = lonLatAlt[0]
         msgToSend.payload.data['lat'] = lonLatAlt[1]
         msgToSend.payload.data['alt'] = lonLatAlt[2]
@@ -1375,11 +2070,10 @@ class Client(MessageParser):
             ClientTimeoutError: Timeout while waiting for response or log from the XCOM server
             ResponseError: The response from the system was not 'OK'.
         '''
-        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id)
+        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id, 4)
         msgToSend.payload.data['time'] = time
         msgToSend.payload.data['timeMode'] = timeMode
         msgToSend.payload.data['cmdParamID'] = 4
-        msgToSend.payload.structString += 'dddddd'
         msgToSend.payload.data['vN'] = vNED[0]
         msgToSend.payload.data['vE'] = vNED[1]
         msgToSend.payload.data['vD'] = vNED[2]
@@ -1401,11 +2095,10 @@ class Client(MessageParser):
             ClientTimeoutError: Timeout while waiting for response or log from the XCOM server
             ResponseError: The response from the system was not 'OK'.
         '''
-        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id)
+        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id, 5)
         msgToSend.payload.data['time'] = time
         msgToSend.payload.data['timeMode'] = timeMode
         msgToSend.payload.data['cmdParamID'] = 5
-        msgToSend.payload.structString += 'dd'
         msgToSend.payload.data['heading'] = heading
         msgToSend.payload.data['headingStdDev'] = standard_dev
         self.send_msg_and_waitfor_okay(msgToSend)
@@ -1423,11 +2116,10 @@ class Client(MessageParser):
             ClientTimeoutError: Timeout while waiting for response or log from the XCOM server
             ResponseError: The response from the system was not 'OK'.
         '''
-        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id)
+        msgToSend = data.getCommandWithID(data.CMD_EXTAID_Payload.command_id, 6)
         msgToSend.payload.data['time'] = time
         msgToSend.payload.data['timeMode'] = timeMode
         msgToSend.payload.data['cmdParamID'] = 6
-        msgToSend.payload.structString += 'dd'
         msgToSend.payload.data['height'] = height
         msgToSend.payload.data['heightStdDev'] = standard_dev
         self.send_msg_and_waitfor_okay(msgToSend)
@@ -1,9 +1,13 @@
 import collections
-from collections.abc import Iterable
+from collections.abc import Iterable, MutableMapping
+import copy
 import struct
+import threading
 from enum import Flag, IntEnum, IntFlag, auto
 from typing import NamedTuple, List
 
+import numpy
+
 from . import crc16
 from .exceptions import ParseError
 
@@ -410,6 +414,11 @@ class EkfStatus:
 
 
 # Payload classes
+NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4',
+    'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8',
+}
+
 class PayloadItem(NamedTuple):
     name: str
     dimension: int
@@ -482,15 +491,32 @@ class PayloadItem(NamedTuple):
         else:
             return [dt_null for _ in range(0, self.dimension)]
 
+    def get_numpy_dtype(self):
+        '''Returns the numpy field spec of the item, e.g. ('acc', 'f4', 3)'''
+        if isinstance(self.datatype, Message):
+            field_type = self.datatype.get_numpy_dtype()
+        elif self.datatype == 's':
+            return (self.name, 'S%d' % self.dimension)
+        else:
+            field_type = NUMPY_TYPES[self.datatype]
+        if self.dimension == 0:
+            return (self.name, list())
+        if self.dimension == 1:
+            return (self.name, field_type)
+        return (self.name, field_type, self.dimension)
+
+    def get_value_count(self):
+        '''Returns the number of values the item takes from the unpacked struct tuple'''
+        if isinstance(self.datatype, str):
+            return 1 if self.datatype == 's' else self.dimension
+        return self.datatype.value_count*self.dimension
+
     def consume(self, input_values):
         output_values = []
         if isinstance(self.datatype, str):
-            if self.datatype == 's':
-                num_to_pop = 1
-            else:
-                num_to_pop = self.dimension
-            for _ in range(0, num_to_pop):
-                output_values.append(input_values.pop(0))
+            num_to_pop = self.get_value_count()
+            output_values = input_values[:num_to_pop]
+            del input_values[:num_to_pop]
         else:
             for _ in range(0, self.dimension):
                 output_values.append(self.datatype.consume(input_values))
@@ -500,17 +526,112 @@ class PayloadItem(NamedTuple):
             return {self.name: output_values}
 
 
+class BytesPayloadItem(PayloadItem):
+    '''Payload item with binary data, decoded as bytes like datatype 's'
+
+    Numpy strips trailing zeros from 'S' fields, so the numpy field is a uint8 array instead.
+    '''
+    __slots__ = ()
+
+    def get_numpy_dtype(self):
+        return (self.name, 'u1', self.dimension)
+
+
 class Message:
     def __init__(self, item_list: List[PayloadItem], name = ''):
         self.item_list = item_list
         self.data = self.generate_data_dict()
         self.struct_inst = struct.Struct(self.generate_final_struct_string())
         self.name = name
+        self.decode_plan, self.value_count = self.compile_decode_plan()
+        self.numpy_dtype = None
+        self.frame_numpy_dtype = None
+        self.field_decoders = None
+
+    def get_field_decoders(self):
+        '''Returns a dictionary item name -> (byte offset, Message of the item alone), built once per Message'''
+        if self.field_decoders is None:
+            field_decoders = dict()
+            offset = 0
+            for item in self.item_list:
+                field_message = Message([item], self.name)
+                field_decoders[item.name] = (offset, field_message)
+                offset += field_message.get_size()
+            self.field_decoders = field_decoders
+        return self.field_decoders
+
+    def get_numpy_dtype(self):
+        '''Returns the numpy dtype spec of the message as list of field specs, built once per Message'''
+        if self.numpy_dtype is None:
+            self.numpy_dtype = [item.get_numpy_dtype() for item in self.item_list]
+        return self.numpy_dtype
+
+    def compile_decode_plan(self):
+        '''Compiles the item list into a plan for decode
+
+        Returns:
+            Tuple (plan, value_count): the plan holds a tuple (name, start, count, sub_message) per item,
+            start being the index of its first value in the unpacked struct tuple and sub_message the
+            Message of nested items or None. value_count is the number of values of the whole message.
+        '''
+        plan = []
+        value_count = 0
+        for item in self.item_list:
+            if isinstance(item.datatype, str):
+                plan.append((item.name, value_count, item.get_value_count(), None))
+            else:
+                plan.append((item.name, value_count, item.dimension, item.datatype))
+            value_count += item.get_value_count()
+        return plan, value_count
+
+    def decode(self, values, offset = 0):
+        '''Builds the data dictionary from the unpacked struct tuple
+
+        Works like consume, but takes the values by index instead of removing them, so the
+        cost is linear in the number of values.
+
+        Args:
+            values: Tuple as returned by struct_inst.unpack_from
+            offset: Index of the first value of the message in values
+        '''
+        data = dict()
+        for name, start, count, sub_message in self.decode_plan:
+            start += offset
+            if sub_message is None:
+                data[name] = values[start] if count == 1 else list(values[start:start + count])
+            elif count == 1:
+                data[name] = sub_message.decode(values, start)
+            else:
+                step = sub_message.value_count
+                data[name] = [sub_message.decode(values, start + idx*step) for idx in range(count)]
+        return data
+
+    def encode(self, data, values):
+        '''Appends the values of the data dictionary to values in struct order, the inverse of decode
+
+        Args:
+            data: Data dictionary of the message
+            values: List the values are appended to
+        Returns:
+            values
+        '''
+        for name, start, count, sub_message in self.decode_plan:
+            value = data[name]
+            if sub_message is None:
+                if count == 1:
+                    values.append(value)
+                else:
+                    values.extend(value)
+            elif count == 1:
+                sub_message.encode(value, values)
+            else:
+                for sub_data in value:
+                    sub_message.encode(sub_data, values)
+        return values
 
     def unpack_from(self, buffer, offset = 0):
         try:
-            values = list(self.struct_inst.unpack_from(buffer, offset))
-            return self.consume(values)
+            return self.decode(self.struct_inst.unpack_from(buffer, offset))
         except struct.error:
             raise ParseError(f'Could not convert {self.name}')
 
@@ -549,9 +670,8 @@ class Message:
         return self.struct_inst.size
 
     def consume(self, values):
-        data = dict()
-        for item in self.item_list:
-            data.update(item.consume(values))
+        data = self.decode(values)
+        del values[:self.value_count]
         return data
 
 
@@ -613,6 +733,13 @@ class ProtocolHeader(MessageItem):
             'time_of_week_usec': self.timeOfWeek_usec}
         return d
 
+    @staticmethod
+    def get_numpy_dtype():
+        return [
+            ('sync', 'u1'), ('msg_id', 'u1'), ('frame_counter', 'u1'), ('reserved_header', 'u1'),
+            ('msg_length', 'u2'), ('week', 'u2'), ('time_of_week_sec', 'u4'), ('time_of_week_usec', 'u4'),
+        ]
+
     def set_data(self, d):
         self.sync = d['sync']
         self.msgID = d['msg_id']
@@ -624,6 +751,26 @@ class ProtocolHeader(MessageItem):
         self.timeOfWeek_usec = d['time_of_week_usec']
 
 
+HEADER_PEEK_STRUCT = struct.Struct('=xBxxHHII')
+SUB_ID_STRUCT = struct.Struct('=H')
+
+def peek_header(buffer, offset = 0):
+    '''Reads the routing information of the frame at offset without decoding it
+
+    Args:
+        buffer: bytes-like object containing the frame
+        offset: Index of the sync byte of the frame in buffer
+    Returns:
+        Tuple (msgID, msgLength, sub_id, week, time_of_week). sub_id is the plugin message ID of plugin
+        messages, the parameter ID of parameters and the command ID of commands, 0 for other frames.
+    '''
+    msgID, msgLength, week, timeOfWeek_sec, timeOfWeek_usec = HEADER_PEEK_STRUCT.unpack_from(buffer, offset)
+    sub_id = 0
+    if msgID in (MessageID.PLUGIN, MessageID.PARAMETER, MessageID.COMMAND) and msgLength >= 18:
+        sub_id = SUB_ID_STRUCT.unpack_from(buffer, offset + 16)[0]
+    return msgID, msgLength, sub_id, week, timeOfWeek_sec + 1.0e-6*timeOfWeek_usec
+
+
 class ProtocolBottom(MessageItem):
     structString = "=HH"
 
@@ -644,15 +791,85 @@ class ProtocolBottom(MessageItem):
                 'crc': self.crc}
         return d
 
+    @staticmethod
+    def get_numpy_dtype():
+        return [('global_status', 'u2'), ('crc', 'u2')]
+
     def set_data(self, d):
         self.gStatus = d['global_status']
         self.crc = d['crc']
 
 
+CRC_STRUCT = struct.Struct('=H')
+
+def get_frame_struct(payload_struct_string):
+    '''Returns the struct of a frame from the header up to the global status, i.e. without the CRC'''
+    return struct.Struct(ProtocolHeader.structString + payload_struct_string[1:] + 'H')
+
+class PayloadLayout:
+    '''Describes the payload of one payload class and varsize arg
+
+    Holds the Message objects of the payload, which carry the struct and the decode plan, the
+    struct used to encode whole frames and the numpy dtype of whole frames with this payload.
+    '''
+    def __init__(self, descriptions):
+        self.descriptions = descriptions
+        self.message_description = descriptions['message_description']
+        self.structString = self.message_description.generate_final_struct_string()
+        self.struct_inst = self.message_description.struct_inst
+        self.frame_struct_inst = get_frame_struct(self.structString)
+        self.numpy_dtype = None
+
+    def get_numpy_dtype(self):
+        if self.numpy_dtype is None:
+            self.numpy_dtype = numpy.dtype(ProtocolHeader.get_numpy_dtype() + self.message_description.get_numpy_dtype() + ProtocolBottom.get_numpy_dtype())
+        return self.numpy_dtype
+
+LAYOUT_CACHE_SIZE = 1024
+_layout_cache = collections.OrderedDict()
+_layout_cache_lock = threading.Lock()
+
+def get_payload_layout(payload, varsize_arg):
+    '''Returns the PayloadLayout of the class of payload for varsize_arg
+
+    Layouts are kept in a process-wide cache keyed by (payload class, varsize arg), which drops the
+    least recently used layouts beyond LAYOUT_CACHE_SIZE entries.
+    '''
+    key = (type(payload), varsize_arg)
+    with _layout_cache_lock:
+        layout = _layout_cache.get(key)
+        if layout is not None:
+            _layout_cache.move_to_end(key)
+            return layout
+    if varsize_arg is None:
+        layout = PayloadLayout({'message_description': type(payload).message_description})
+    else:
+        layout = PayloadLayout(payload.get_varsize_descriptions(varsize_arg))
+    with _layout_cache_lock:
+        _layout_cache[key] = layout
+        while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    return layout
+
+def _extract_values(diction):
+    values = []
+    for value in diction.values():
+        if isinstance(value, (list, tuple)):
+            if len(value):
+                if isinstance(value[0], dict):
+                    for curd in value:
+                        values +=_extract_values(curd)
+                else:
+                    values += value
+        elif isinstance(value, dict):
+            values += _extract_values(value)
+        else:
+            values += [value]
+    return values
+
 class ProtocolPayload(MessageItem):
     message_id = 0
     message_description = Message([])
-    init_opts = {}
     get_varsize_item_list = None
     get_varsize_arg_from_bytes = None
 
@@ -662,34 +879,30 @@ class ProtocolPayload(MessageItem):
         # - optional to create an empty message
         # - unused for from_bytes (gets its own varsize_arg for parsing)
         # - required to create a message and use to_bytes
-        if varsize_arg is not None:
-            self.message_description = Message(self.get_varsize_item_list(varsize_arg))
         self._init_from_varsize_arg(varsize_arg)
 
+    def get_varsize_descriptions(self, varsize_arg):
+        '''Builds the Message objects for varsize_arg
+
+        Returns:
+            Dictionary attribute name -> Message, containing at least message_description
+        '''
+        return {'message_description': Message(self.get_varsize_item_list(varsize_arg))}
+
+    def _set_layout(self, varsize_arg):
+        layout = get_payload_layout(self, varsize_arg)
+        for name, description in layout.descriptions.items():
+            setattr(self, name, description)
+        self._structString = layout.structString
+        self.struct_inst = layout.struct_inst
+        self.frame_struct_inst = layout.frame_struct_inst
+        self.message_description.name = self.get_name()
+        self._initarg = varsize_arg
+
     def _init_from_varsize_arg(self, varsize_arg):
-        cls = type(self)
-        if cls not in cls.init_opts:
-            cls.init_opts[cls] = {}
-        _init_opts = cls.init_opts[cls]
-        if varsize_arg in _init_opts:
-            _init = _init_opts[varsize_arg]
-        else:
-            _init = {}
-            if varsize_arg is None:
-                _init['message_description'] = cls.message_description
-            else:
-                _init['message_description'] = self.message_description  # self.message_description must be set before
-            _init['structString'] = _init['message_description'].generate_final_struct_string()
-            _init['struct_inst'] = struct.Struct(_init['structString'])
-            _init['message_description_name'] = self.get_name()
-            _init_opts[varsize_arg] = _init
-        self.message_description = _init['message_description']
-        self._structString = _init['structString']
-        self.struct_inst = _init['struct_inst']
-        self.message_description.name = _init['message_description_name']
+        self._set_layout(varsize_arg)
         # alwalys create own data dict
         self.data = self.message_description.generate_data_dict()
-        self._initarg = varsize_arg
 
     @classmethod
     def _is_varsize(cls):
@@ -703,33 +916,41 @@ class ProtocolPayload(MessageItem):
     def structString(self, value):
         self._structString = value
         self.struct_inst = struct.Struct(self._structString)
+        self.frame_struct_inst = get_frame_struct(self._structString)
+
+    def get_values(self):
+        '''Returns the values of the data dictionary as list in struct order'''
+        if self.struct_inst is self.message_description.struct_inst:
+            return self.message_description.encode(self.data, [])
+        # the struct string has been extended by hand, take the values in the order of the data dictionary
+        return _extract_values(self.data)
 
     def to_bytes(self):
-        def extract_values(diction):
-            values = []
-            for value in diction.values():
-                if isinstance(value, (list, tuple)):
-                    if len(value):
-                        if isinstance(value[0], dict):
-                            for curd in value:
-                                values +=extract_values(curd)
-                        else:
-                            values += value
-                elif isinstance(value, dict):
-                    values += extract_values(value)
-                else:
-                    values += [value]
-            return values
-        values = extract_values(self.data)
-        return bytearray(self.struct_inst.pack(*values))
+        return bytearray(self.struct_inst.pack(*self.get_values()))
+
+    def get_layout(self):
+        '''Returns the PayloadLayout of the current varsize arg'''
+        return get_payload_layout(self, self._initarg)
 
     def from_bytes(self, inBytes):
         if self.get_varsize_arg_from_bytes:
             _varsiz_arg = self.get_varsize_arg_from_bytes(inBytes)
             if _varsiz_arg != self._initarg:
-                self.__init__(_varsiz_arg)
+                self._set_layout(_varsiz_arg)
+                # the fields of the new layout are all set below
+                self.data = collections.OrderedDict()
         self.data.update(self.message_description.unpack_from(inBytes))
 
+    def from_bytes_lazy(self, inBytes):
+        '''Like from_bytes, but keeps a copy of inBytes and decodes each field on first access'''
+        if self.get_varsize_arg_from_bytes:
+            _varsiz_arg = self.get_varsize_arg_from_bytes(inBytes)
+            if _varsiz_arg != self._initarg:
+                self._set_layout(_varsiz_arg)
+        if len(inBytes) < self.struct_inst.size:
+            raise ParseError(f'Could not convert {self.message_description.name}')
+        self.data = LazyPayloadData(self.message_description, bytes(inBytes))
+
     @classmethod
     def get_name(cls):
         classname = cls.__name__
@@ -747,14 +968,33 @@ class ProtocolMessage(MessageItem):
         self.bottom  = ProtocolBottom()
 
     def to_bytes(self):
-        self.header.msgLength = self.size()
-        header = self.header.to_bytes()
-        payload = self.payload.to_bytes()
-        bottom = self.bottom.to_bytes()
-        msgBytes = header + payload + bottom[:2]
-        self.bottom.crc = crc16.crc16xmodem(bytes(msgBytes))
-        bottom = self.bottom.to_bytes()
-        return header + payload + bottom
+        msgBytes = bytearray(self.size())
+        self.to_bytes_into(msgBytes)
+        return msgBytes
+
+    def to_bytes_into(self, buf, offset = 0):
+        '''Encodes the message into a writable buffer, e.g. to send many messages with one sendall
+
+        Header, payload and global status are written by a single pack_into of the struct cached
+        for the payload layout, followed by the CRC.
+
+        Args:
+            buf: Writable buffer, e.g. a bytearray, with room for size() bytes at offset
+            offset: Index of the first byte of the message in buf
+        Returns:
+            The number of bytes written
+        '''
+        header = self.header
+        msgLength = header.msgLength = self.size()
+        self.payload.frame_struct_inst.pack_into(buf, offset,
+            header.sync, header.msgID, header.frameCounter, header.reserved, msgLength,
+            header.week, header.timeOfWeek_sec, header.timeOfWeek_usec,
+            *self.payload.get_values(), self.bottom.gStatus)
+        crc_offset = offset + msgLength - 2
+        with memoryview(buf) as view:
+            self.bottom.crc = crc16.crc16xmodem(view[offset:crc_offset])
+        CRC_STRUCT.pack_into(buf, crc_offset, self.bottom.crc)
+        return msgLength
 
     def from_bytes(self, inBytes):
         headerBytes = inBytes[:16]
@@ -764,6 +1004,19 @@ class ProtocolMessage(MessageItem):
         bottomBytes = inBytes[self.header.msgLength-4:self.header.msgLength]
         self.bottom.from_bytes(bottomBytes)
 
+    def copy(self):
+        '''Returns an independent copy of the message
+
+        Messages published by a pooled MessageParser are refilled with the next frame of the same
+        type; a copy can be kept beyond the callback.
+        '''
+        message = copy.copy(self)
+        message.header = copy.copy(self.header)
+        message.payload = copy.copy(self.payload)
+        message.payload.data = copy.deepcopy(self.payload.data)
+        message.bottom = copy.copy(self.bottom)
+        return message
+
     @property
     def data(self):
         result = self.header.get_data()
@@ -801,102 +1054,162 @@ class ProtocolMessage(MessageItem):
         return struct_inst.iter_unpack(buffer)
 
     def get_numpy_dtype(self):
-        struct_string = self.header.structString[1:] + self.payload.structString[1:] + self.bottom.structString[1:]
-        current_item = ''
-        item_list = []
-        dtype_list = []
-        type_string = 'fdsbBhHiIlLqQ'
-        while len(struct_string) > 0:
-            while struct_string[0] not in type_string:
-                current_item += struct_string[0]
-                struct_string = struct_string[1:]
-            current_item += struct_string[0]
-            struct_string = struct_string[1:]
-            item_list.append(current_item)
-            current_item = ''
-
-        def construct_item_spec_from_msg_def(fieldname, item):
-            cardinality = item.rstrip(type_string)
-            if len(cardinality) == 0:
-                cardinality = 1
-            else:
-                cardinality = int(cardinality)
-            dtype = item[-1]
-            if dtype in 'bB':
-                byte_size = '1'
-            elif dtype in 'hH':
-                byte_size = '2'
-            elif dtype in 'iIflL':
-                byte_size = '4'
-            elif dtype in 'dQq':
-                byte_size = '8'
-            if dtype in 'bhilq':
-                out_type = 'i'
-            elif dtype in 'BHILQ':
-                out_type = 'u'
-            elif dtype in 'fd':
-                out_type = 'f'
-            elif dtype in 's':
-                out_type = 'S'
-
-            if out_type == 'S':
-                out_type = 'S'+str(cardinality)
-                item_spec = (fieldname, out_type)
-            else:
-                out_type = out_type + byte_size
-                if cardinality == 1:
-                    item_spec = (fieldname, out_type)
-                else:
-                    item_spec = (fieldname, out_type, cardinality)
-            return item_spec
-
-        def build_dtype_list(data, item_list):
-            dtype_list = []
-            idx_offset = 0
-            for idx, fieldname in enumerate(data.keys()):
-                item = item_list[idx+idx_offset]
-                is_nested = False
-                is_nested_list = False
-                is_empty_list = False
-                if (type(data[fieldname]) is type(list())):
-                    if data[fieldname]:
-                        if (type(data[fieldname][0]) is type(dict())):
-                            is_nested = True
-                            is_nested_list = True
-                    else:
-                        is_empty_list = True
-                else:
-                    if (type(data[fieldname]) is type(dict())):
-                        is_nested = True
-                if is_nested:
-                    if is_nested_list:
-                        sublist_length = len(data[fieldname][0])
-                        dtype_sublist, nested_offset = build_dtype_list(data[fieldname][0],
-                            item_list[idx+idx_offset:])
-                        nestet_list_length = len(data[fieldname])
-                        idx_offset += sublist_length * nestet_list_length - 1 + nestet_list_length * nested_offset
-                        item_spec = (fieldname, dtype_sublist, nestet_list_length)
-                    else:
-                        sublist_length = len(data[fieldname])
-                        dtype_sublist, nested_offset = build_dtype_list(data[fieldname],
-                            item_list[idx+idx_offset:])
-                        idx_offset += sublist_length - 1 + nested_offset
-                        item_spec = (fieldname, dtype_sublist)
-                elif is_empty_list:
-                    if item[0] != "0":
-                        idx_offset -= 1
-                    item_spec = (fieldname, list())
-                else:
-                    item_spec = construct_item_spec_from_msg_def(fieldname, item)
-                dtype_list.append(item_spec)
-            return dtype_list, idx_offset
-        
-        return build_dtype_list(self.data, item_list)[0]
+        '''Returns the numpy dtype spec of the whole frame as list of field specs
+
+        The spec is built from the payload's Message tree once and cached on it, so it is shared by all
+        messages of the same payload class and varsize arg and must not be modified.
+        '''
+        description = self.payload.message_description
+        if description.frame_numpy_dtype is None:
+            description.frame_numpy_dtype = self.header.get_numpy_dtype() + description.get_numpy_dtype() + self.bottom.get_numpy_dtype()
+        return description.frame_numpy_dtype
 
     def size(self):
         return self.header.size()+self.payload.size()+self.bottom.size()
 
 
+class LazyPayloadData(MutableMapping):
+    '''Data dictionary of a payload which decodes its fields from the payload bytes on first access
+
+    Decoded and assigned values are cached. Iterating, len() and decode_all() decode all remaining
+    fields with one unpack of the payload struct.
+    '''
+    def __init__(self, message_description, buffer):
+        self.message_description = message_description
+        self.buffer = buffer
+        self.values = dict()
+
+    def decode_all(self):
+        '''Decodes all fields which have not been decoded yet and returns the dictionary of all values'''
+        if self.buffer is not None:
+            values = self.message_description.unpack_from(self.buffer)
+            values.update(self.values)
+            self.values = values
+            self.buffer = None
+        return self.values
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            if self.buffer is None:
+                raise
+        decoder = self.message_description.get_field_decoders().get(key)
+        if decoder is None:
+            raise KeyError(key)
+        offset, field_message = decoder
+        value = self.values[key] = field_message.unpack_from(self.buffer, offset)[key]
+        return value
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def __delitem__(self, key):
+        del self.decode_all()[key]
+
+    def __contains__(self, key):
+        if key in self.values:
+            return True
+        return self.buffer is not None and key in self.message_description.get_field_decoders()
+
+    def __iter__(self):
+        return iter(self.decode_all())
+
+    def __len__(self):
+        return len(self.decode_all())
+
+    def __deepcopy__(self, memo):
+        # the Message is shared, the buffer is immutable
+        result = LazyPayloadData(self.message_description, self.buffer)
+        result.values = copy.deepcopy(self.values, memo)
+        return result
+
+    def __repr__(self):
+        return f'LazyPayloadData({self.decode_all()!r})'
+
+
+class LazyProtocolMessage(ProtocolMessage):
+    '''ProtocolMessage which decodes the payload fields on first access
+
+    from_bytes decodes header and bottom, the payload data is a LazyPayloadData. The merged
+    dictionary returned by data is built once per frame.
+    '''
+    def __init__(self, varsizearg=None):
+        super().__init__(varsizearg)
+        self._data = None
+
+    @classmethod
+    def wrap(cls, message):
+        '''Returns a LazyProtocolMessage with the header, payload and bottom of message'''
+        lazy_message = cls.__new__(cls)
+        lazy_message._data = None
+        lazy_message.header = message.header
+        lazy_message.payload = message.payload
+        lazy_message.bottom = message.bottom
+        return lazy_message
+
+    def from_bytes(self, inBytes):
+        self._data = None
+        self.header.from_bytes(inBytes[:16])
+        self.payload.from_bytes_lazy(inBytes[16:self.header.msgLength-4])
+        self.bottom.from_bytes(inBytes[self.header.msgLength-4:self.header.msgLength])
+
+    def to_bytes_into(self, buf, offset = 0):
+        if isinstance(self.payload.data, LazyPayloadData):
+            self.payload.data.decode_all()
+        return super().to_bytes_into(buf, offset)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = ProtocolMessage.data.fget(self)
+        return self._data
+
+
+class VarsizeRecords:
+    '''Decoded frames of a variable size message, one structured array per layout
+
+    Indexing and iterating give the frames in their original order as single-record arrays,
+    slicing gives a list of them.
+
+    Attributes:
+        varsize_args: Varsize arg of each layout
+        arrays: Structured array of each layout with its frames in original order
+        layout: Index of the layout of each frame
+        row: Index of each frame within the array of its layout
+    '''
+    def __init__(self, varsize_args, arrays, layout, row):
+        self.varsize_args = varsize_args
+        self.arrays = arrays
+        self.layout = layout
+        self.row = row
+
+    def __len__(self):
+        return len(self.layout)
+
+    def __getitem__(self, frame_idx):
+        if isinstance(frame_idx, slice):
+            return [self[idx] for idx in range(*frame_idx.indices(len(self)))]
+        row = self.row[frame_idx]
+        return self.arrays[self.layout[frame_idx]][row:row + 1]
+
+    def __iter__(self):
+        for layout_idx, row in zip(self.layout.tolist(), self.row.tolist()):
+            yield self.arrays[layout_idx][row:row + 1]
+
+    def get_array(self, varsize_arg):
+        '''Returns the structured array of the frames with varsize_arg'''
+        return self.arrays[self.varsize_args.index(varsize_arg)]
+
+    def get_field(self, name):
+        '''Returns a field in frame order, e.g. gpstime, which must have the same type in all layouts'''
+        field = numpy.empty(len(self), dtype=self.arrays[0].dtype[name]) if self.arrays else numpy.empty(0)
+        for layout_idx, array in enumerate(self.arrays):
+            frame_idx = numpy.flatnonzero(self.layout == layout_idx)
+            field[frame_idx] = array[name][self.row[frame_idx]]
+        return field
+
+
 class DefaultCommandPayload(ProtocolPayload):
     message_id = MessageID.COMMAND
     command_id = 0
@@ -909,14 +1222,16 @@ class DefaultCommandPayload(ProtocolPayload):
 
     def __init__(self, varsize_arg=None):
         cls = type(self)
-        if varsize_arg is not None:
-            self.command_payload = Message(self.get_varsize_item_list(varsize_arg))
-            self.message_description = Message(cls.command_header.item_list + self.command_payload.item_list)
-            self._init_from_varsize_arg(varsize_arg)
-        else:
-            if cls.message_description is None:
-                cls.message_description = Message(cls.command_header.item_list + cls.command_payload.item_list)
-            self._init_from_varsize_arg(None)
+        if varsize_arg is None and cls.message_description is None:
+            cls.message_description = Message(cls.command_header.item_list + cls.command_payload.item_list)
+        self._init_from_varsize_arg(varsize_arg)
+
+    def get_varsize_descriptions(self, varsize_arg):
+        command_payload = Message(self.get_varsize_item_list(varsize_arg))
+        return {
+            'command_payload': command_payload,
+            'message_description': Message(type(self).command_header.item_list + command_payload.item_list),
+        }
 
 class DefaultPluginMessagePayload(ProtocolPayload):
     message_id = MessageID.PLUGIN
@@ -930,14 +1245,16 @@ class DefaultPluginMessagePayload(ProtocolPayload):
 
     def __init__(self, varsize_arg=None):
         cls = type(self)
-        if varsize_arg is not None:
-            self.plugin_message_payload = Message(self.get_varsize_item_list(varsize_arg))
-            self.message_description = Message(cls.plugin_message_header.item_list + self.plugin_message_payload.item_list)
-            self._init_from_varsize_arg(varsize_arg)
-        else:
-            if cls.message_description is None:
-                cls.message_description = Message(cls.plugin_message_header.item_list + cls.plugin_message_payload.item_list)
-            self._init_from_varsize_arg(None)
+        if varsize_arg is None and cls.message_description is None:
+            cls.message_description = Message(cls.plugin_message_header.item_list + cls.plugin_message_payload.item_list)
+        self._init_from_varsize_arg(varsize_arg)
+
+    def get_varsize_descriptions(self, varsize_arg):
+        plugin_message_payload = Message(self.get_varsize_item_list(varsize_arg))
+        return {
+            'plugin_message_payload': plugin_message_payload,
+            'message_description': Message(type(self).plugin_message_header.item_list + plugin_message_payload.item_list),
+        }
 
     def payload_from_bytes(self, in_bytes):
         if self.get_varsize_arg_from_bytes:
@@ -957,14 +1274,16 @@ class DefaultParameterPayload(ProtocolPayload):
 
     def __init__(self, varsize_arg=None):
         cls = type(self)
-        if varsize_arg is not None:
-            self.parameter_payload = Message(self.get_varsize_item_list(varsize_arg))
-            self.message_description = Message(cls.parameter_header.item_list + self.parameter_payload.item_list)
-            self._init_from_varsize_arg(varsize_arg)
-        else:
-            if cls.message_description is None:
-                cls.message_description = Message(cls.parameter_header.item_list + cls.parameter_payload.item_list)
-            self._init_from_varsize_arg(None)
+        if varsize_arg is None and cls.message_description is None:
+            cls.message_description = Message(cls.parameter_header.item_list + cls.parameter_payload.item_list)
+        self._init_from_varsize_arg(varsize_arg)
+
+    def get_varsize_descriptions(self, varsize_arg):
+        parameter_payload = Message(self.get_varsize_item_list(varsize_arg))
+        return {
+            'parameter_payload': parameter_payload,
+            'message_description': Message(type(self).parameter_header.item_list + parameter_payload.item_list),
+        }
 
     def payload_from_bytes(self, in_bytes):
         if self.get_varsize_arg_from_bytes:
@@ -983,16 +1302,20 @@ class DefaultPluginParameterPayload(DefaultParameterPayload):
 
     def __init__(self, varsize_arg=None):
         cls = type(self)
-        if varsize_arg is not None:
-            self.plugin_parameter_payload = Message(self.get_varsize_item_list(varsize_arg))
-            self.parameter_payload = Message(cls.plugin_parameter_header.item_list +self.plugin_parameter_payload.item_list )
-            self.message_description = Message(cls.parameter_header.item_list + self.parameter_payload.item_list)
-            self._init_from_varsize_arg(varsize_arg)
-        else:
-            if cls.message_description is None:
-                cls.parameter_payload = Message(cls.plugin_parameter_header.item_list + cls.plugin_parameter_payload.item_list)
-                cls.message_description = Message(cls.parameter_header.item_list + cls.parameter_payload.item_list)
-            self._init_from_varsize_arg(None)
+        if varsize_arg is None and cls.message_description is None:
+            cls.parameter_payload = Message(cls.plugin_parameter_header.item_list + cls.plugin_parameter_payload.item_list)
+            cls.message_description = Message(cls.parameter_header.item_list + cls.parameter_payload.item_list)
+        self._init_from_varsize_arg(varsize_arg)
+
+    def get_varsize_descriptions(self, varsize_arg):
+        cls = type(self)
+        plugin_parameter_payload = Message(self.get_varsize_item_list(varsize_arg))
+        parameter_payload = Message(cls.plugin_parameter_header.item_list + plugin_parameter_payload.item_list)
+        return {
+            'plugin_parameter_payload': plugin_parameter_payload,
+            'parameter_payload': parameter_payload,
+            'message_description': Message(cls.parameter_header.item_list + parameter_payload.item_list),
+        }
         
     def payload_from_bytes(self, in_bytes):
         if self.get_varsize_arg_from_bytes:
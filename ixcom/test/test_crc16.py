@@ -0,0 +1,94 @@
+import random
+import unittest
+from unittest import mock
+
+from ixcom import crc16
+
+LENGTHS = (0, 1, 511, 512, crc16.POSITION_TABLE_ROWS, crc16.POSITION_TABLE_ROWS + 1)
+
+crc16_pure = getattr(crc16, '__crc16_pure')
+
+
+def crc16_bitwise(data, crc=0):
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        crc &= 0xffff
+    return crc
+
+
+def make_frame(payload):
+    return payload + crc16_bitwise(payload).to_bytes(2, 'little')
+
+
+class TestCrc16(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(1)
+        cls.data = [bytes(rng.getrandbits(8) for _ in range(length)) for length in LENGTHS]
+
+    def test_check_value(self):
+        self.assertEqual(crc16_bitwise(b'123456789'), 0x31C3)
+        self.assertEqual(crc16.crc16xmodem(b'123456789'), 0x31C3)
+
+    def test_crc16_pure(self):
+        for data in self.data:
+            for crc in (0, 0x1D0F, 0xFFFF):
+                self.assertEqual(crc16_pure(data, crc), crc16_bitwise(data, crc), len(data))
+
+    def test_crc16xmodem(self):
+        for data in self.data:
+            self.assertEqual(crc16.crc16xmodem(data), crc16_bitwise(data))
+            self.assertEqual(crc16.crc16xmodem(memoryview(data)), crc16_bitwise(data))
+
+    @unittest.skipUnless(crc16.fastcrc_installed, 'fastcrc is not installed')
+    def test_fastcrc(self):
+        for data in self.data:
+            self.assertEqual(crc16_pure(data, 0), crc16.fastcrc.crc16.xmodem(data))
+
+    def test_crc16_xmodem_chunked(self):
+        rng = random.Random(2)
+        for data in self.data:
+            for _ in range(5):
+                splits = sorted(rng.randrange(len(data) + 1) for _ in range(rng.randrange(4)))
+                crc = crc16.Crc16Xmodem()
+                for start, end in zip([0] + splits, splits + [len(data)]):
+                    crc.update(data[start:end])
+                self.assertEqual(crc.digest(), crc16_bitwise(data))
+            crc.reset()
+            self.assertEqual(crc.digest(), 0)
+            self.assertEqual(crc16.Crc16Xmodem(data).digest(), crc16_bitwise(data))
+
+    def verify(self, buffer, offsets, lengths):
+        valid = crc16.verify_frames(buffer, offsets, lengths)
+        with mock.patch.object(crc16, 'fastcrc_installed', False):
+            self.assertEqual(crc16.verify_frames(buffer, offsets, lengths).tolist(), valid.tolist())
+        return valid.tolist()
+
+    def test_verify_frames(self):
+        buffer = bytearray(b'\x7e')
+        offsets = []
+        lengths = []
+        expected = []
+        for data in self.data[1:]:
+            for corrupt in (False, True):
+                frame = bytearray(make_frame(data))
+                if corrupt:
+                    frame[len(frame) // 2] ^= 0x01
+                offsets.append(len(buffer))
+                lengths.append(len(frame))
+                expected.append(not corrupt)
+                buffer += frame
+        self.assertEqual(self.verify(bytes(buffer), offsets, lengths), expected)
+        self.assertEqual(self.verify(bytes(buffer), offsets[::-1], lengths[::-1]), expected[::-1])
+        self.assertEqual(self.verify(bytes(buffer), [], []), [])
+
+    def test_verify_frames_without_data(self):
+        # frames which consist of the CRC only are never valid
+        buffer = make_frame(b'') + make_frame(b'\x00')
+        self.assertEqual(self.verify(buffer, [0, 2], [2, 3]), [False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ixcom import grep
+from ixcom.exceptions import ParseError
+from .test_parser import make_frames, make_noisy_stream
+
+
+def concatenate_ranges(ranges):
+    offsets, lengths, crc_ok = zip(*ranges)
+    return np.concatenate(offsets), np.concatenate(lengths), np.concatenate(crc_ok)
+
+
+class TestGrowableArray(unittest.TestCase):
+    def test_get(self):
+        dtype = np.dtype([('a', '<u4'), ('b', '<f8')])
+        growable = grep.GrowableArray(dtype)
+        self.assertEqual(len(growable.get()), 0)
+        expected = np.zeros(0, dtype=dtype)
+        for count in (1, 0, 7, 5000, 3, 20000, 1, 70000):
+            values = np.zeros(count, dtype=dtype)
+            values['a'] = np.arange(len(expected), len(expected) + count)
+            values['b'] = 0.5*values['a']
+            if count % 2:
+                growable.append(values)
+            else:
+                growable.extend(count)[:] = values
+            expected = np.concatenate([expected, values])
+        array = growable.get()
+        self.assertEqual(array.dtype, dtype)
+        self.assertEqual(array.tobytes(), expected.tobytes())
+        self.assertTrue(array.flags.owndata)
+        self.assertIs(growable.get(), array)
+
+    def test_earlier_arrays_stay_valid(self):
+        growable = grep.GrowableArray(np.int64, capacity=4)
+        growable.append(np.arange(3))
+        first = growable.get()
+        growable.append(np.arange(3, 100000))
+        second = growable.get()
+        self.assertEqual(first.tolist(), [0, 1, 2])
+        self.assertEqual(second.tolist(), list(range(100000)))
+
+
+class TestFrameFile(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.frames = make_frames(1)
+        cls.stream = make_noisy_stream(cls.frames, 2)
+        fd, cls.filename = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(cls.stream)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def assertFramesEqual(self, frames, other_frames):
+        for array, other_array in zip(frames, other_frames):
+            self.assertEqual(array.tolist(), other_array.tolist())
+
+    def test_single_range(self):
+        offsets, lengths, crc_ok, next_pos = grep.frame_range(self.stream, 0, len(self.stream), anchored=True)
+        self.assertEqual(next_pos, len(self.stream))
+        valid_frames = [self.stream[offset:offset + length] for offset, length in zip(offsets[crc_ok], lengths[crc_ok])]
+        self.assertEqual(valid_frames, self.frames)
+        self.assertGreater(np.count_nonzero(~crc_ok), 0)
+
+    def test_chunk_size(self):
+        single_range = grep.frame_range(self.stream, 0, len(self.stream), anchored=True)[:3]
+        for chunk_size in (997, 4096, len(self.stream) // 3, len(self.stream)):
+            self.assertFramesEqual(grep.frame_file(self.filename, workers=2, chunk_size=chunk_size), single_range)
+            self.assertFramesEqual(concatenate_ranges(grep.iter_frame_ranges(self.stream, chunk_size=chunk_size)), single_range)
+
+    def test_disable_crc(self):
+        single_range = grep.frame_range(self.stream, 0, len(self.stream), anchored=True, disable_crc=True)[:3]
+        self.assertTrue(single_range[2].all())
+        for chunk_size in (997, 4096):
+            self.assertFramesEqual(grep.frame_file(self.filename, workers=2, chunk_size=chunk_size, disable_crc=True),
+                                   single_range)
+            self.assertFramesEqual(concatenate_ranges(grep.iter_frame_ranges(self.stream, disable_crc=True, chunk_size=chunk_size)),
+                                   single_range)
+
+    def test_range_boundaries(self):
+        # equally long frames put the range boundaries at, before and behind frame starts,
+        # ranges shorter than a frame contain no frame start at all
+        frame = self.frames[1]
+        self.assertEqual(frame[1], 0)
+        stream = b'\x7e\x00' + frame*50
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(stream)
+        try:
+            expected = [2 + idx*len(frame) for idx in range(50)]
+            for chunk_size in (len(frame) - 1, len(frame), len(frame) + 1, 2*len(frame), 30):
+                offsets, lengths, crc_ok = grep.frame_file(f.name, workers=2, chunk_size=chunk_size)
+                self.assertEqual(offsets[crc_ok].tolist(), expected)
+                offsets, lengths, crc_ok = concatenate_ranges(grep.iter_frame_ranges(stream, chunk_size=chunk_size))
+                self.assertEqual(offsets[crc_ok].tolist(), expected)
+        finally:
+            os.remove(f.name)
+
+
+class TestFrameIndex(unittest.TestCase):
+    def setUp(self):
+        self.frames = make_frames(1)
+        self.stream = make_noisy_stream(self.frames, 2)
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'iXCOMstream.bin')
+        with open(self.filename, 'wb') as f:
+            f.write(self.stream)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(grep.load_frame_index(self.filename))
+        index = grep.build_frame_index(self.filename)
+        loaded_index = grep.load_frame_index(self.filename)
+        self.assertEqual(loaded_index.tobytes(), index.tobytes())
+        valid = index[index['crc_ok']]
+        self.assertEqual(len(valid), len(self.frames))
+        self.assertEqual(sorted(bytes(self.stream[offset:offset + length]) for offset, length in zip(valid['offset'], valid['length'])),
+                         sorted(self.frames))
+
+    def test_query(self):
+        grep.build_frame_index(self.filename)
+        index = grep.load_frame_index(self.filename)
+        frame_offsets = [self.stream.find(frame) for frame in self.frames]
+        inssol = grep.query_frame_index(index, 3)
+        self.assertGreater(np.count_nonzero(~inssol['crc_ok']), 0)
+        inssol = inssol[inssol['crc_ok']]
+        self.assertEqual(inssol['offset'].tolist(), [offset for offset, frame in zip(frame_offsets, self.frames) if frame[1] == 3])
+        parameters = grep.query_frame_index(index, 0xFF, sub_id=2)
+        self.assertEqual(parameters[parameters['crc_ok']]['offset'].tolist(),
+                         [offset for offset, frame in zip(frame_offsets, self.frames) if frame[1] == 0xFF and frame[16] == 2])
+        times = inssol['time_of_week']
+        selected = grep.query_frame_index(index, 3, start_time=times[10], end_time=times[20])
+        self.assertEqual(selected[selected['crc_ok']]['offset'].tolist(), inssol['offset'][10:21].tolist())
+        self.assertFalse(grep.query_frame_index(index, 0x42)['crc_ok'].any())
+
+    def test_read_file_with_index(self):
+        messages = grep.read_file(self.filename)
+        grep.build_frame_index(self.filename)
+        indexed_messages = grep.read_file(self.filename)
+        self.assertEqual(list(indexed_messages), list(messages))
+        for key, value in messages.items():
+            if key == 'config':
+                self.assertEqual(indexed_messages[key], value)
+            else:
+                self.assertEqual(indexed_messages[key].tobytes(), value.tobytes())
+
+    def test_stale_index(self):
+        grep.build_frame_index(self.filename)
+        stat = os.stat(self.filename)
+        # same size and modification time, but different content, e.g. a recording replaced by cp -p
+        with open(self.filename, 'r+b') as f:
+            f.write(b'\x00')
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(grep.load_frame_index(self.filename))
+        with open(self.filename, 'wb') as f:
+            f.write(self.stream)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNotNone(grep.load_frame_index(self.filename))
+        with open(self.filename, 'ab') as f:
+            f.write(self.frames[0])
+        self.assertIsNone(grep.load_frame_index(self.filename))
+
+    def test_truncated_recording(self):
+        grep.build_frame_index(self.filename)
+        with open(self.filename, 'r+b') as f:
+            f.truncate(len(self.stream) // 2)
+        self.assertIsNone(grep.load_frame_index(self.filename))
+        messages = grep.read_file(self.filename)
+        self.assertLess(len(messages['INSSOL']), len([frame for frame in self.frames if frame[1] == 3]))
+
+    def test_invalid_sidecar(self):
+        index = grep.build_frame_index(self.filename)
+        with open(grep.get_frame_index_filename(self.filename), 'wb') as f:
+            np.save(f, index)
+        self.assertIsNone(grep.load_frame_index(self.filename))
+        with open(grep.get_frame_index_filename(self.filename), 'wb') as f:
+            f.write(b'no index')
+        self.assertIsNone(grep.load_frame_index(self.filename))
+
+
+class TestXcomDataset(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.filename = os.path.join(cls.directory.name, 'iXCOMstream.bin')
+        with open(cls.filename, 'wb') as f:
+            f.write(make_noisy_stream(make_frames(1), 2))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_same_as_read_file(self):
+        messages = grep.read_file(self.filename)
+        dataset = grep.read_file(self.filename, lazy=True)
+        self.assertIsInstance(dataset, grep.XcomDataset)
+        self.assertEqual(list(dataset), list(messages))
+        self.assertEqual(len(dataset), len(messages))
+        for key, value in dataset.items():
+            self.assertIn(key, dataset)
+            if key == 'config':
+                self.assertEqual(value, messages[key])
+            else:
+                self.assertEqual(value.tobytes(), messages[key].tobytes())
+        self.assertIs(dataset['INSSOL'], dataset['INSSOL'])
+        self.assertNotIn('GNSSSOL', dataset)
+        self.assertIsNone(dataset.get('GNSSSOL'))
+
+    def test_decode_error(self):
+        dataset = grep.read_file(self.filename, lazy=True)
+        with mock.patch.object(grep, 'decode_message_frames', side_effect=ParseError('bad frame')), \
+                mock.patch('builtins.print'):
+            self.assertIn('INSSOL', dataset)
+            with self.assertRaises(ParseError):
+                dataset['INSSOL']
+            with self.assertRaises(ParseError):
+                dataset.get('INSSOL')
+        self.assertEqual(len(dataset['INSSOL']), len(grep.read_file(self.filename)['INSSOL']))
+
+
+if __name__ == '__main__':
+    unittest.main()
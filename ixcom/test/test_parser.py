@@ -0,0 +1,145 @@
+import random
+import unittest
+
+from ixcom import data
+from ixcom.parser import MessageSearcher
+
+NUM_FRAMES = 600
+CLEAN_TAIL_FRAMES = 10
+
+
+def make_frames(seed):
+    '''Returns valid frames of several messages and parameters'''
+    rng = random.Random(seed)
+    frames = []
+    for frame_idx in range(NUM_FRAMES):
+        kind = rng.randrange(4)
+        if kind == 0:
+            message = data.getMessageWithID(0)
+        elif kind == 1:
+            message = data.getMessageWithID(3)
+        elif kind == 2:
+            message = data.getMessageWithID(0x10)
+        else:
+            message = data.getParameterWithID(rng.choice([0, 2, 4]))
+        message.header.frameCounter = frame_idx & 0xff
+        message.header.set_time(0.01*frame_idx)
+        frames.append(bytes(message.to_bytes()))
+    return frames
+
+
+def make_noisy_stream(frames, seed):
+    '''Puts noise with false sync bytes and corrupted frames between frames
+
+    Some false sync bytes claim a length which spans the next frame, so that the frame
+    can only be found by searching again behind the false sync byte.
+    '''
+    rng = random.Random(seed)
+    stream = bytearray()
+    for frame_idx, frame in enumerate(frames):
+        if frame_idx < len(frames) - CLEAN_TAIL_FRAMES:
+            if rng.random() < 0.3:
+                noise = bytearray(rng.getrandbits(8) for _ in range(rng.randrange(1, 60)))
+                for pos in range(0, len(noise) - 6, 7):
+                    if rng.random() < 0.5:
+                        length = rng.randrange(7, 300)
+                        noise[pos] = 0x7E
+                        noise[pos + 4:pos + 6] = length.to_bytes(2, 'little')
+                stream += noise
+            if rng.random() < 0.1:
+                corrupted = bytearray(frame)
+                corrupted[rng.randrange(6, len(corrupted))] ^= 0x55
+                stream += corrupted
+            if rng.random() < 0.1:
+                length = 6 + len(frame) + rng.randrange(0, 20)
+                stream += bytes([0x7E, 3, 0, 0]) + length.to_bytes(2, 'little')
+        stream += frame
+    return bytes(stream)
+
+
+def random_splits(length, rng, num_splits):
+    return sorted(rng.sample(range(1, length), min(num_splits, length - 1)))
+
+
+class TestMessageSearcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.frames = make_frames(1)
+        cls.stream = make_noisy_stream(cls.frames, 2)
+
+    def search(self, splits, stream=None, **filter_args):
+        if stream is None:
+            stream = self.stream
+        searcher = MessageSearcher()
+        if filter_args:
+            searcher.set_filter(**filter_args)
+        published = []
+        searcher.add_callback(lambda msg_bytes: published.append(bytes(msg_bytes)))
+        start = 0
+        for end in list(splits) + [len(stream)]:
+            searcher.process_bytes(stream[start:end])
+            start = end
+        return published, searcher.get_statistics()
+
+    def chunkings(self, stream=None):
+        if stream is None:
+            stream = self.stream
+        rng = random.Random(3)
+        yield []
+        yield range(1, len(stream))
+        yield range(4096, len(stream), 4096)
+        for num_splits in (1, 10, 100, 1000):
+            yield random_splits(len(stream), rng, num_splits)
+        yield [idx for idx, byte in enumerate(stream) if byte == 0x7E and idx > 0]
+
+    def test_frames_independent_of_chunking(self):
+        for splits in self.chunkings():
+            published, _ = self.search(splits)
+            self.assertEqual(published, self.frames)
+
+    def test_statistics(self):
+        published, statistics = self.search([])
+        self.assertEqual(len(published), NUM_FRAMES)
+        self.assertEqual(sum(statistics.frames_published.values()), NUM_FRAMES)
+        self.assertEqual(statistics.bytes_consumed, len(self.stream))
+        self.assertGreater(sum(statistics.crc_failures.values()), 0)
+        self.assertGreater(statistics.resyncs, 0)
+        self.assertGreater(statistics.bytes_recovered, 0)
+        for splits in self.chunkings():
+            _, chunked_statistics = self.search(splits)
+            self.assertEqual(chunked_statistics.frames_published, statistics.frames_published)
+
+    def test_filter(self):
+        filters = (
+            ({'message_ids': [3]}, lambda frame: frame[1] == 3),
+            ({'parameter_ids': [2]}, lambda frame: frame[1] != data.MessageID.PARAMETER or frame[16] == 2),
+            ({'message_ids': [0x10], 'parameter_ids': [0, 4]},
+             lambda frame: frame[1] == 0x10 or (frame[1] == data.MessageID.PARAMETER and frame[16] in (0, 4))),
+        )
+        clean_stream = b''.join(self.frames)
+        for filter_args, accepts in filters:
+            expected = [frame for frame in self.frames if accepts(frame)]
+            self.assertGreater(len(expected), 0)
+            for splits in self.chunkings(clean_stream):
+                published, _ = self.search(splits, clean_stream, **filter_args)
+                self.assertEqual(published, expected)
+            # on noisy input, a false frame behind a valid frame may hide frames, but nothing else is published
+            for splits in self.chunkings():
+                published, _ = self.search(splits, **filter_args)
+                remaining = iter(expected)
+                self.assertTrue(all(frame in remaining for frame in published))
+                self.assertGreater(len(published), 0.95*len(expected))
+
+    def test_filter_after_noise(self):
+        # a false frame which does not pass the filter spans the next frame and ends on a sync byte
+        inssol = self.frames[0]
+        self.assertEqual(inssol[1], 3)
+        false_length = 6 + len(inssol)
+        stream = inssol + b'\x00' + bytes([0x7E, 0, 0, 0]) + false_length.to_bytes(2, 'little') + inssol + inssol
+        for splits in self.chunkings(stream):
+            published, _ = self.search(splits, stream, message_ids=[3])
+            self.assertEqual(published, [inssol]*3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+from unittest import mock
+
+from ixcom import commands, data, messages, protocol
+from ixcom.parser import MessageParser
+
+
+class TestVarsizePayload(unittest.TestCase):
+    def setUp(self):
+        protocol._layout_cache.clear()
+
+    def test_extaid_varsize_args_in_sequence(self):
+        frames = {}
+        for cmd_param_id in (3, 4, 5, 6):
+            payload = commands.CMD_EXTAID_Payload(cmd_param_id)
+            payload.data['cmdParamID'] = cmd_param_id
+            frames[cmd_param_id] = bytes(payload.to_bytes())
+        protocol._layout_cache.clear()
+        payload = commands.CMD_EXTAID_Payload()
+        for cmd_param_id in (3, 4, 5, 6, 3):
+            payload.from_bytes(frames[cmd_param_id])
+            expected = commands.CMD_EXTAID_Payload(cmd_param_id)
+            self.assertEqual(payload.data['cmdParamID'], cmd_param_id)
+            self.assertEqual(list(payload.data), list(expected.data))
+            self.assertEqual(payload.struct_inst.size, len(frames[cmd_param_id]))
+
+
+class TestLayoutCache(unittest.TestCase):
+    def setUp(self):
+        protocol._layout_cache.clear()
+        self.payload = messages.MONITOR_Payload()
+
+    def test_eviction(self):
+        with mock.patch.object(protocol, 'LAYOUT_CACHE_SIZE', 4):
+            layouts = [protocol.get_payload_layout(self.payload, len_logmsg) for len_logmsg in range(1, 5)]
+            self.assertEqual(len(protocol._layout_cache), 4)
+            # a hit makes the layout the most recently used one
+            self.assertIs(protocol.get_payload_layout(self.payload, 1), layouts[0])
+            protocol.get_payload_layout(self.payload, 5)
+            self.assertEqual(len(protocol._layout_cache), 4)
+            self.assertEqual([key[1] for key in protocol._layout_cache], [3, 4, 1, 5])
+            self.assertIsNot(protocol.get_payload_layout(self.payload, 2), layouts[1])
+            self.assertEqual([key[1] for key in protocol._layout_cache], [4, 1, 5, 2])
+
+    def test_varsize_args(self):
+        short_layout = protocol.get_payload_layout(self.payload, 5)
+        long_layout = protocol.get_payload_layout(self.payload, 10)
+        self.assertIsNot(short_layout, long_layout)
+        self.assertEqual(short_layout.struct_inst.size, 6)
+        self.assertEqual(long_layout.struct_inst.size, 11)
+        fixed_layout = protocol.get_payload_layout(self.payload, None)
+        self.assertIs(fixed_layout.message_description, messages.MONITOR_Payload.message_description)
+        self.assertEqual(len(protocol._layout_cache), 3)
+
+    def test_shared_layout(self):
+        first = messages.MONITOR_Payload()
+        second = messages.MONITOR_Payload()
+        first.from_bytes(b'\x01hello')
+        second.from_bytes(b'\x02world')
+        self.assertEqual(first.data['logmsg'], b'hello')
+        self.assertEqual(second.data['logmsg'], b'world')
+        layout = protocol.get_payload_layout(first, 5)
+        self.assertIs(first.get_layout(), layout)
+        self.assertIs(second.get_layout(), layout)
+        self.assertIs(first.message_description, layout.message_description)
+        self.assertIs(second.message_description, layout.message_description)
+        self.assertIsNot(first.data, second.data)
+
+
+def make_frame(msg_id, seed):
+    '''Returns a frame of msg_id with distinct values in all payload fields'''
+    message = data.getMessageWithID(msg_id)
+    message.header.set_time(seed + 0.5)
+    for idx, (key, value) in enumerate(message.payload.data.items()):
+        if isinstance(value, list):
+            message.payload.data[key] = [type(item)(seed + 0.25*(idx + item_idx)) for item_idx, item in enumerate(value)]
+        else:
+            message.payload.data[key] = type(value)(seed + idx)
+    return bytes(message.to_bytes())
+
+
+class TestLazyProtocolMessage(unittest.TestCase):
+    def test_same_values_as_eager_message(self):
+        monitor = data.getMessageWithID(0x57)
+        monitor.payload = messages.MONITOR_Payload(11)
+        monitor.payload.data['logmsg'] = b'lazy\x00 frame'[:11]
+        frames = [make_frame(msg_id, 3) for msg_id in (0, 3, 0x10)] + [bytes(monitor.to_bytes())]
+        for frame in frames:
+            eager_message = data.getMessageWithID(frame[1])
+            eager_message.from_bytes(frame)
+            lazy_message = protocol.LazyProtocolMessage.wrap(data.getMessageWithID(frame[1]))
+            lazy_message.from_bytes(frame)
+            self.assertIsInstance(lazy_message.payload.data, protocol.LazyPayloadData)
+            for key, value in eager_message.payload.data.items():
+                self.assertEqual(lazy_message.payload.data[key], value)
+            self.assertEqual(lazy_message.data, eager_message.data)
+            self.assertEqual(lazy_message.header.get_time(), eager_message.header.get_time())
+            self.assertEqual(lazy_message.bottom.crc, eager_message.bottom.crc)
+            self.assertEqual(bytes(lazy_message.to_bytes()), frame)
+
+    def test_parser_publishes_lazy_messages(self):
+        frames = [make_frame(msg_id, seed) for seed in range(3) for msg_id in (0, 3)]
+        published = {}
+        for lazy in (False, True):
+            parser = MessageParser(lazy_messages=lazy)
+            published[lazy] = []
+            parser.add_callback(lambda message, from_device: published[lazy].append((type(message), message.data)))
+            parser.messageSearcher.process_bytes(b''.join(frames))
+        self.assertTrue(all(message_type is protocol.LazyProtocolMessage for message_type, _ in published[True]))
+        self.assertEqual([values for _, values in published[True]], [values for _, values in published[False]])
+
+    def test_copy(self):
+        first, second = make_frame(3, 1), make_frame(3, 2)
+        eager_message = data.getMessageWithID(3)
+        eager_message.from_bytes(first)
+        copies = []
+        parser = MessageParser(pool_messages=True, lazy_messages=True)
+        parser.add_callback(lambda message, from_device: copies.append(message.copy()), [3])
+        buffer = bytearray(first)
+        parser.messageSearcher.process_bytes(buffer)
+        # the pooled message is refilled and the source buffer is overwritten by the next frame
+        buffer[:] = second
+        parser.messageSearcher.process_bytes(buffer)
+        self.assertEqual(len(copies), 2)
+        self.assertIsNot(copies[0].payload.data, copies[1].payload.data)
+        self.assertIsInstance(copies[0].payload.data, protocol.LazyPayloadData)
+        self.assertEqual(copies[0].payload.data['lon'], eager_message.payload.data['lon'])
+        self.assertEqual(dict(copies[0].payload.data), eager_message.payload.data)
+        copies[1].payload.data['lon'] = 0.0
+        self.assertEqual(copies[0].payload.data['lon'], eager_message.payload.data['lon'])
+        self.assertNotEqual(dict(copies[1].payload.data), dict(copies[0].payload.data))
+
+
+if __name__ == '__main__':
+    unittest.main()